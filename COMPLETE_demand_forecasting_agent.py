@@ -30,12 +30,14 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import os
+import hashlib
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 import warnings
-from sklearn.linear_model import LinearRegression
-from statsmodels.tsa.holtwinters import ExponentialSmoothing
+from joblib import Parallel, delayed
 
 warnings.filterwarnings('ignore')
 load_dotenv()
@@ -60,6 +62,33 @@ AVAILABLE_MODELS = [
     'gemini-2.5-flash',
 ]
 
+SALES_CSV = "data/sales_history.csv"
+SALES_PARQUET = "data/sales_history.parquet"  # Columnar cache of SALES_CSV
+
+# Seconds to skip a key/model pair after it reports quota exhaustion
+MODEL_COOLDOWN_SECONDS = 60
+
+# Maximum number of fitted Holt-Winters models kept in memory
+HW_MODEL_CACHE_SIZE = 256
+
+# Days of history needed before external factors and Holt-Winters are used
+MIN_DAYS_FOR_FACTOR_MODEL = 90
+
+
+def _hw_model_key(sku, y):
+    """Holt-Winters cache key: SKU plus a hash of its daily sales history"""
+    return (sku, hash(y.tobytes()))
+
+
+def _fit_holt_winters(y):
+    """Fit the weekly additive Holt-Winters model on a daily sales array (None if the fit fails)"""
+    # Imported lazily: statsmodels is slow to load and only needed here
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+    try:
+        return ExponentialSmoothing(pd.Series(y), seasonal_periods=7, trend='add', seasonal='add').fit()
+    except:
+        return None
+
 
 class DemandForecastingAgent:
     """
@@ -74,6 +103,10 @@ class DemandForecastingAgent:
         print("=" * 80)
         
         self.current_key_index = 0
+        self._clients = [genai.Client(api_key=key) for key in API_KEYS]
+        self._llm_cache = {}  # SHA-256 of prompt -> response text
+        self._model_cooldown = {}  # (key index, model) -> time quota resets
+        self._hw_cache = OrderedDict()  # (sku, sales history hash) -> fitted model
         self.sales_data = None
         self.prescription_data = None
         self.weather_data = None
@@ -90,10 +123,40 @@ class DemandForecastingAgent:
         """Load historical sales and prescription data"""
         try:
             print("Loading historical data...")
-            self.sales_data = pd.read_csv("data/sales_history.csv")
-            self.sales_data['date'] = pd.to_datetime(self.sales_data['date'])
+            # Prefer the parquet copy unless the CSV has been regenerated since
+            if os.path.exists(SALES_PARQUET) and os.path.getmtime(SALES_PARQUET) >= os.path.getmtime(SALES_CSV):
+                self.sales_data = pd.read_parquet(SALES_PARQUET)
+            else:
+                self.sales_data = pd.read_csv(SALES_CSV, parse_dates=['date'])
+                try:
+                    self.sales_data.to_parquet(SALES_PARQUET, index=False)
+                except OSError:
+                    pass  # Read-only data directory - keep using the CSV
+            # Categorize after either path: other agents share the parquet copy
+            self.sales_data['sku'] = self.sales_data['sku'].astype('category')
+            self.sales_data['product_name'] = self.sales_data['product_name'].astype('category')
             print(f"  ✓ Loaded {len(self.sales_data):,} sales records")
             
+            # Per-SKU sales slices, sorted by date, for O(1) lookup
+            self._sales_by_sku = {
+                sku: group.sort_values('date').reset_index(drop=True)
+                for sku, group in self.sales_data.groupby('sku', sort=False, observed=True)
+            }
+            
+            # Seasonal product flags per SKU: (flu medicine, allergy medicine)
+            self._sku_season_flags = {}
+            for sku, sku_sales in self._sales_by_sku.items():
+                name = str(sku_sales['product_name'].iloc[0]).lower()
+                self._sku_season_flags[sku] = ('flu' in name, 'allerg' in name)
+            
+            # Daily unit totals per SKU (grouped once), and their average for velocity classification
+            daily_totals = self.sales_data.groupby(['sku', 'date'], sort=False, observed=True)['quantity_sold'].sum()
+            self._daily_sales_by_sku = {
+                sku: totals.droplevel('sku').sort_index()
+                for sku, totals in daily_totals.groupby(level='sku', sort=False, observed=True)
+            }
+            self._sku_avg_daily = daily_totals.groupby(level='sku', observed=True).mean().to_dict()
+            
         except FileNotFoundError:
             print("\n❌ ERROR: Data files not found!")
             print("Run: python generate_sample_data.py")
@@ -105,55 +168,57 @@ class DemandForecastingAgent:
         
         # 1. WEATHER PATTERNS DATA
         dates = pd.date_range(end=datetime.now(), periods=365, freq='D')
-        np.random.seed(42)
+        rng = np.random.default_rng(42)
+        n_days = len(dates)
+        months = dates.month.to_numpy()
+        days = dates.day.to_numpy()
         
         self.weather_data = pd.DataFrame({
             'date': dates,
-            'temperature': np.random.normal(25, 8, len(dates)),  # Celsius
-            'humidity': np.random.uniform(40, 90, len(dates)),
-            'rainfall': np.random.exponential(5, len(dates)),
-            'season': pd.cut(dates.month, bins=[0, 3, 6, 9, 12], 
-                           labels=['Winter', 'Spring', 'Summer', 'Autumn'])
-        })
+            'temperature': rng.normal(25, 8, n_days),  # Celsius
+            'humidity': rng.uniform(40, 90, n_days),
+            'rainfall': rng.exponential(5, n_days),
+            'season': np.select([months <= 3, months <= 6, months <= 9],
+                                ['Winter', 'Spring', 'Summer'], default='Autumn')
+        }).set_index('date')
         
         # 2. DISEASE OUTBREAK DATA
         self.disease_data = pd.DataFrame({
             'date': dates,
-            'flu_index': np.random.poisson(3, len(dates)),  # Higher in winter
-            'dengue_cases': np.random.poisson(2, len(dates)),  # Higher in monsoon
-            'allergy_index': np.random.uniform(1, 10, len(dates)),  # Seasonal
-            'covid_cases': np.random.poisson(5, len(dates))
-        })
+            'flu_index': rng.poisson(3, n_days),  # Higher in winter
+            'dengue_cases': rng.poisson(2, n_days),  # Higher in monsoon
+            'allergy_index': rng.uniform(1, 10, n_days),  # Seasonal
+            'covid_cases': rng.poisson(5, n_days)
+        }).set_index('date')
         
         # Add seasonality to disease data
-        for i, date in enumerate(dates):
-            month = date.month
-            # Flu higher in winter (Nov-Feb)
-            if month in [11, 12, 1, 2]:
-                self.disease_data.loc[i, 'flu_index'] *= 3
-            # Dengue higher in monsoon (Jul-Sep)
-            if month in [7, 8, 9]:
-                self.disease_data.loc[i, 'dengue_cases'] *= 4
-            # Allergies higher in spring (Mar-May)
-            if month in [3, 4, 5]:
-                self.disease_data.loc[i, 'allergy_index'] *= 2
+        # Flu higher in winter (Nov-Feb)
+        self.disease_data.loc[np.isin(months, [11, 12, 1, 2]), 'flu_index'] *= 3
+        # Dengue higher in monsoon (Jul-Sep)
+        self.disease_data.loc[np.isin(months, [7, 8, 9]), 'dengue_cases'] *= 4
+        # Allergies higher in spring (Mar-May)
+        self.disease_data.loc[np.isin(months, [3, 4, 5]), 'allergy_index'] *= 2
         
         # 3. PROMOTION & PRICING HISTORY
         self.promotion_data = pd.DataFrame({
             'date': dates,
-            'promotion_active': np.random.choice([0, 1], len(dates), p=[0.7, 0.3]),
-            'discount_pct': np.random.choice([0, 5, 10, 15, 20], len(dates), p=[0.7, 0.1, 0.1, 0.05, 0.05]),
+            'promotion_active': rng.choice([0, 1], n_days, p=[0.7, 0.3]),
+            'discount_pct': rng.choice([0, 5, 10, 15, 20], n_days, p=[0.7, 0.1, 0.1, 0.05, 0.05]),
             'festival_period': 0
-        })
+        }).set_index('date')
+        
+        # Mark festival periods (Diwali, Christmas, New Year, etc.)
+        festival = ((months == 10) & (days >= 15) & (days <= 25)) | \
+                   ((months == 12) & (days >= 20)) | \
+                   ((months == 1) & (days <= 5))
+        self.promotion_data['festival_period'] = festival.astype(int)
         
-        # Mark festival periods
-        for i, date in enumerate(dates):
-            month, day = date.month, date.day
-            # Diwali, Christmas, New Year, etc.
-            if (month == 10 and 15 <= day <= 25) or \
-               (month == 12 and day >= 20) or \
-               (month == 1 and day <= 5):
-                self.promotion_data.loc[i, 'festival_period'] = 1
+        # Forecast-relevant factors combined once, indexed by date for lookups
+        self.external_factors = pd.concat([
+            self.weather_data[['temperature', 'season']],
+            self.disease_data[['flu_index', 'allergy_index']],
+            self.promotion_data[['promotion_active', 'discount_pct']]
+        ], axis=1)
         
         # 4. LOCAL DEMOGRAPHICS & DOCTOR PRESCRIPTION BEHAVIOR
         self.demographics_data = {
@@ -191,39 +256,43 @@ class DemandForecastingAgent:
         print(f"  ✓ Doctor behavior: {len(self.doctor_behavior)} doctors")
     
     def call_gemini_multi_key(self, prompt):
-        """Try multiple API keys until one works"""
+        """Try multiple API keys until one works (cached by prompt hash)"""
+        cache_key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        if cache_key in self._llm_cache:
+            return self._llm_cache[cache_key]
+        
         for key_idx in range(len(API_KEYS)):
-            api_key = API_KEYS[(self.current_key_index + key_idx) % len(API_KEYS)]
-            client = genai.Client(api_key=api_key)
+            key_pos = (self.current_key_index + key_idx) % len(API_KEYS)
+            client = self._clients[key_pos]
             
             for model_name in AVAILABLE_MODELS:
+                # Skip key/model pairs that recently hit their quota
+                if time.time() < self._model_cooldown.get((key_pos, model_name), 0):
+                    continue
                 try:
                     response = client.models.generate_content(
                         model=model_name,
                         contents=prompt,
                         config=types.GenerateContentConfig(temperature=0.7)
                     )
-                    self.current_key_index = (self.current_key_index + key_idx) % len(API_KEYS)
+                    self.current_key_index = key_pos
+                    self._llm_cache[cache_key] = response.text
                     return response.text
                 except Exception as e:
                     error_str = str(e)
-                    if any(x in error_str for x in ['429', 'RESOURCE_EXHAUSTED', '404', 'NOT_FOUND']):
-                        continue
-                    else:
-                        continue
+                    if any(x in error_str for x in ['429', 'RESOURCE_EXHAUSTED']):
+                        self._model_cooldown[(key_pos, model_name)] = time.time() + MODEL_COOLDOWN_SECONDS
+                    continue
         
         return f"⚠️ All {len(API_KEYS)} API keys at capacity."
     
     def classify_product_velocity(self, sku):
         """Classify as Fast-Moving, Medium-Moving, or Slow-Moving"""
-        sku_sales = self.sales_data[self.sales_data['sku'] == sku]
+        avg_daily_sales = self._sku_avg_daily.get(sku)
         
-        if len(sku_sales) == 0:
+        if avg_daily_sales is None:
             return "Unknown"
         
-        daily_sales = sku_sales.groupby('date')['quantity_sold'].sum()
-        avg_daily_sales = daily_sales.mean()
-        
         # Classification thresholds
         if avg_daily_sales >= 10:
             return "Fast-Moving"
@@ -234,24 +303,76 @@ class DemandForecastingAgent:
     
     def detect_demand_surge(self, forecast_df, historical_avg):
         """Detect demand surge alerts"""
-        surge_alerts = []
+        yhat = forecast_df['yhat'].to_numpy()
+        
+        # Surge if predicted > 150% of historical average
+        mask = yhat > historical_avg * 1.5
+        surge_dates = forecast_df['ds'][mask]
+        predicted = yhat[mask]
+        surge_pct = ((predicted / historical_avg) - 1) * 100
+        alert_levels = np.where(predicted > historical_avg * 2, 'HIGH', 'MEDIUM')
+        
+        return [
+            {
+                'date': date,
+                'predicted_demand': round(pred, 1),
+                'historical_avg': round(historical_avg, 1),
+                'surge_pct': round(pct, 1),
+                'alert_level': str(level)
+            }
+            for date, pred, pct, level in zip(surge_dates, predicted, surge_pct, alert_levels)
+        ]
+    
+    def _forecast_with_factor_model(self, sku, daily_sales, days_ahead):
+        """Correlate sales with external factors and fit the Holt-Winters base forecast"""
+        # Attach external factors on the sorted date index
+        daily_sales = daily_sales.set_index('ds').join(self.external_factors)
         
-        for idx, row in forecast_df.iterrows():
-            predicted = row['yhat']
-            
-            # Surge if predicted > 150% of historical average
-            if predicted > historical_avg * 1.5:
-                surge_alerts.append({
-                    'date': row['ds'],
-                    'predicted_demand': round(predicted, 1),
-                    'historical_avg': round(historical_avg, 1),
-                    'surge_pct': round(((predicted / historical_avg) - 1) * 100, 1),
-                    'alert_level': 'HIGH' if predicted > historical_avg * 2 else 'MEDIUM'
-                })
-        
-        return surge_alerts
+        # Fill missing values - only the joined factor columns can contain gaps
+        factor_values = self.external_factors.columns.drop('season')
+        daily_sales[factor_values] = daily_sales[factor_values].ffill().fillna(0)
+        daily_sales['season'] = daily_sales['season'].ffill().fillna('Unknown')
+        
+        # Calculate correlation with external factors
+        factor_cols = ['y', 'temperature', 'flu_index', 'allergy_index', 'promotion_active']
+        corr_with_y = daily_sales[factor_cols].corr()['y'].fillna(0)
+        correlations = {
+            'weather_impact': corr_with_y['temperature'],
+            'flu_impact': corr_with_y['flu_index'],
+            'allergy_impact': corr_with_y['allergy_index'],
+            'promotion_impact': corr_with_y['promotion_active']
+        }
+        
+        # Base forecast using Exponential Smoothing (fits cached per SKU history)
+        model_key = _hw_model_key(sku, daily_sales['y'].to_numpy())
+        fitted_model = self._hw_cache.get(model_key)
+        if fitted_model is None:
+            fitted_model = _fit_holt_winters(daily_sales['y'].to_numpy())
+            if fitted_model is not None:
+                self._cache_hw_fit(model_key, fitted_model)
+        else:
+            self._hw_cache.move_to_end(model_key)
+        
+        base_forecast = None
+        if fitted_model is not None:
+            try:
+                base_forecast = fitted_model.forecast(steps=days_ahead)
+            except:
+                pass
+        if base_forecast is None:
+            # Fallback to simple moving average
+            base_forecast = pd.Series([daily_sales['y'].mean()] * days_ahead)
+        
+        return correlations, base_forecast
     
-    def forecast_with_external_factors(self, sku, days_ahead=30):
+    def _cache_hw_fit(self, model_key, fitted_model):
+        """Add a Holt-Winters fit to the LRU cache"""
+        self._hw_cache[model_key] = fitted_model
+        self._hw_cache.move_to_end(model_key)
+        if len(self._hw_cache) > HW_MODEL_CACHE_SIZE:
+            self._hw_cache.popitem(last=False)
+    
+    def forecast_with_external_factors(self, sku, days_ahead=30, verbose=True):
         """
         Complete forecasting with ALL required inputs:
         - Historical sales
@@ -261,13 +382,14 @@ class DemandForecastingAgent:
         - Doctor behavior
         - Promotions
         """
-        print(f"\n📊 COMPLETE DEMAND FORECAST: {sku}")
-        print("=" * 80)
+        if verbose:
+            print(f"\n📊 COMPLETE DEMAND FORECAST: {sku}")
+            print("=" * 80)
         
         # Get historical sales
-        sku_sales = self.sales_data[self.sales_data['sku'] == sku].copy()
+        sku_sales = self._sales_by_sku.get(sku)
         
-        if len(sku_sales) < 30:
+        if sku_sales is None or len(sku_sales) < 30:
             return {
                 "success": False,
                 "message": "Not enough historical data"
@@ -275,78 +397,47 @@ class DemandForecastingAgent:
         
         product_name = sku_sales['product_name'].iloc[0]
         
-        # Prepare daily sales data
-        daily_sales = sku_sales.groupby('date')['quantity_sold'].sum().reset_index()
-        daily_sales.columns = ['ds', 'y']
-        daily_sales = daily_sales.sort_values('ds')
-        
-        # Merge with external factors
-        daily_sales = daily_sales.merge(self.weather_data[['date', 'temperature', 'season']], 
-                                        left_on='ds', right_on='date', how='left')
-        daily_sales = daily_sales.merge(self.disease_data[['date', 'flu_index', 'allergy_index']], 
-                                        left_on='ds', right_on='date', how='left')
-        daily_sales = daily_sales.merge(self.promotion_data[['date', 'promotion_active', 'discount_pct']], 
-                                        left_on='ds', right_on='date', how='left')
+        # Prepare daily sales data (precomputed series are already date-sorted)
+        daily_sales = self._daily_sales_by_sku[sku].rename('y').rename_axis('ds').reset_index()
         
-        # Fill missing values - handle categorical columns separately
-        daily_sales['season'] = daily_sales['season'].astype(str)  # Convert categorical to string
-        daily_sales.fillna(method='ffill', inplace=True)
-        daily_sales.fillna(0, inplace=True)
-        
-        # Calculate correlation with external factors
-        correlations = {
-            'weather_impact': daily_sales[['y', 'temperature']].corr().iloc[0, 1] if 'temperature' in daily_sales.columns else 0,
-            'flu_impact': daily_sales[['y', 'flu_index']].corr().iloc[0, 1] if 'flu_index' in daily_sales.columns else 0,
-            'allergy_impact': daily_sales[['y', 'allergy_index']].corr().iloc[0, 1] if 'allergy_index' in daily_sales.columns else 0,
-            'promotion_impact': daily_sales[['y', 'promotion_active']].corr().iloc[0, 1] if 'promotion_active' in daily_sales.columns else 0
-        }
-        
-        # Base forecast using Exponential Smoothing
-        try:
-            model = ExponentialSmoothing(
-                daily_sales['y'],
-                seasonal_periods=7,
-                trend='add',
-                seasonal='add'
+        if len(daily_sales) < MIN_DAYS_FOR_FACTOR_MODEL:
+            # Short history: correlations and a seasonal fit are not meaningful,
+            # so use a recent moving average and skip the factor pipeline
+            correlations = dict.fromkeys(
+                ['weather_impact', 'flu_impact', 'allergy_impact', 'promotion_impact'], 0.0
             )
-            fitted_model = model.fit()
-            base_forecast = fitted_model.forecast(steps=days_ahead)
-        except:
-            # Fallback to simple moving average
-            base_forecast = pd.Series([daily_sales['y'].mean()] * days_ahead)
+            base_forecast = pd.Series([daily_sales['y'].tail(14).mean()] * days_ahead)
+        else:
+            correlations, base_forecast = self._forecast_with_factor_model(sku, daily_sales, days_ahead)
         
         # Adjust forecast based on external factors
         future_dates = pd.date_range(start=daily_sales['ds'].max() + timedelta(days=1), 
                                      periods=days_ahead, freq='D')
         
-        adjusted_forecast = []
-        for i, date in enumerate(future_dates):
-            base_value = base_forecast.iloc[i]
-            
-            # Adjust for seasonality
-            month = date.month
-            seasonal_multiplier = 1.0
-            
-            # Flu season adjustment (Nov-Feb)
-            if month in [11, 12, 1, 2] and 'flu' in product_name.lower():
-                seasonal_multiplier *= 1.5
-            
-            # Allergy season adjustment (Mar-May)
-            if month in [3, 4, 5] and 'allerg' in product_name.lower():
-                seasonal_multiplier *= 1.3
-            
-            # Festival period adjustment
-            if month in [10, 11, 12]:
-                seasonal_multiplier *= 1.1
-            
-            adjusted_forecast.append(base_value * seasonal_multiplier)
+        # Adjust for seasonality
+        future_months = future_dates.month.to_numpy()
+        seasonal_multiplier = np.ones(days_ahead)
+        is_flu_product, is_allergy_product = self._sku_season_flags[sku]
+        
+        # Flu season adjustment (Nov-Feb)
+        if is_flu_product:
+            seasonal_multiplier[np.isin(future_months, [11, 12, 1, 2])] *= 1.5
+        
+        # Allergy season adjustment (Mar-May)
+        if is_allergy_product:
+            seasonal_multiplier[np.isin(future_months, [3, 4, 5])] *= 1.3
+        
+        # Festival period adjustment
+        seasonal_multiplier[np.isin(future_months, [10, 11, 12])] *= 1.1
+        
+        adjusted_forecast = np.asarray(base_forecast, dtype=float) * seasonal_multiplier
         
         # Create forecast dataframe
         forecast_df = pd.DataFrame({
             'ds': future_dates,
             'yhat': adjusted_forecast,
-            'yhat_lower': [x * 0.8 for x in adjusted_forecast],
-            'yhat_upper': [x * 1.2 for x in adjusted_forecast]
+            'yhat_lower': adjusted_forecast * 0.8,
+            'yhat_upper': adjusted_forecast * 1.2
         })
         
         # Calculate statistics
@@ -396,6 +487,9 @@ class DemandForecastingAgent:
         }
         
         # Print results
+        if not verbose:
+            return result
+        
         print(f"\n📦 Product: {product_name}")
         print(f"🏷️ Velocity Classification: {velocity_class}")
         print(f"\n📈 FORECAST STATISTICS:")
@@ -418,6 +512,28 @@ class DemandForecastingAgent:
         
         return result
     
+    def forecast_many(self, skus, days_ahead=30, n_jobs=-1):
+        """Forecast several SKUs, fitting the uncached Holt-Winters models in parallel worker processes"""
+        skus = list(skus)
+        
+        # Workers receive only each SKU's daily sales array; fits come back into this agent's cache
+        pending = {}
+        for sku in skus:
+            sku_sales = self._sales_by_sku.get(sku)
+            if sku_sales is None or len(sku_sales) < 30:
+                continue
+            y = self._daily_sales_by_sku[sku].to_numpy()
+            model_key = _hw_model_key(sku, y)
+            if len(y) >= MIN_DAYS_FOR_FACTOR_MODEL and model_key not in self._hw_cache:
+                pending[model_key] = y
+        
+        fits = Parallel(n_jobs=n_jobs, batch_size=8)(delayed(_fit_holt_winters)(y) for y in pending.values())
+        for model_key, fitted_model in zip(pending, fits):
+            if fitted_model is not None:
+                self._cache_hw_fit(model_key, fitted_model)
+        
+        return [self.forecast_with_external_factors(sku, days_ahead, verbose=False) for sku in skus]
+    
     def get_ai_recommendations(self, forecast_result):
         """Get AI-powered strategic recommendations"""
         if not forecast_result['success']:
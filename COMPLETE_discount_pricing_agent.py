@@ -30,9 +30,13 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import os
+import copy
+import time
+from collections import OrderedDict
+import httpx
 from dotenv import load_dotenv
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 
 load_dotenv()
 
@@ -47,6 +51,18 @@ for i in range(1, 10):
 
 AVAILABLE_MODELS = ['gemini-2.0-flash', 'gemini-1.5-flash']
 
+# Fixed label vocabularies (stored as categoricals)
+ELASTICITY_CATEGORIES = ['Inelastic', 'Moderately Elastic', 'Highly Elastic']
+PRICE_POSITIONS = ['Discount', 'Competitive', 'Premium']
+CLEARANCE_URGENCY_LEVELS = ["🔴 CRITICAL", "🟡 HIGH", "🟢 MEDIUM"]
+
+RECOMMEND_CACHE_SIZE = 8192  # memoized single-SKU recommendations
+
+# Explicit column dtypes for the CSV loads. Counts fit in int32; prices stay
+# float64 so cent-rounded outputs don't drift.
+INVENTORY_DTYPES = {'current_stock': 'int32', 'reorder_point': 'int32'}
+SALES_DTYPES = {'quantity_sold': 'int32'}
+
 
 class DiscountPricingAgent:
     """
@@ -61,7 +77,14 @@ class DiscountPricingAgent:
         print("=" * 80)
         
         self.current_key_index = 0
+        self._clients = [genai.Client(api_key=key) for key in API_KEYS]
+        self._key_next_ok = {}  # key index -> time the key may be retried
+        self._key_failures = {}  # key index -> consecutive rate-limit hits
+        self._disabled_keys = set()  # keys rejected as invalid
+        self._data_version = 0  # bumped whenever inputs are (re)built
+        self._recommend_cache = OrderedDict()  # (sku, data version, date, min margin) -> recommendation
         self.load_data()
+        self.refresh_sales_velocity()
         self.create_enhanced_pricing_data()
         
         # Pricing parameters
@@ -73,91 +96,135 @@ class DiscountPricingAgent:
     def load_data(self):
         """Load inventory and sales data"""
         try:
-            self.inventory_data = pd.read_csv("data/current_inventory.csv")
-            self.inventory_data['expiry_date'] = pd.to_datetime(self.inventory_data['expiry_date'])
+            # pyarrow engine parses in C++ (multithreaded); columns stay NumPy-backed
+            self.inventory_data = pd.read_csv("data/current_inventory.csv", engine='pyarrow',
+                                              dtype=INVENTORY_DTYPES, parse_dates=['expiry_date'])
+            self._expiry_days_date = None
+            self.refresh_expiry_days()
             
-            self.sales_data = pd.read_csv("data/sales_history.csv")
-            self.sales_data['date'] = pd.to_datetime(self.sales_data['date'])
+            self.sales_data = pd.read_csv("data/sales_history.csv", engine='pyarrow',
+                                          dtype=SALES_DTYPES, parse_dates=['date'])
+            # Date-sorted so time windows are a binary search, not a full scan
+            self.sales_data = self.sales_data.sort_values('date', kind='stable', ignore_index=True)
+            self._velocity_date = None  # velocity is rebuilt from the new sales
+            self._data_version += 1
             
             print(f"  ✓ Loaded inventory and sales data")
         except FileNotFoundError:
             print("\n❌ ERROR: Data files not found!")
             raise
     
+    def refresh_expiry_days(self):
+        """Recompute days-to-expiry per inventory row (only changes when the date rolls over)"""
+        now = datetime.now()
+        if self._expiry_days_date == now.date():
+            return
+        self.inventory_data['days_to_expiry'] = (self.inventory_data['expiry_date'] - now).dt.days
+        self._inv_ix = self.inventory_data.set_index('sku')  # per-SKU rows via .loc
+        self._expiry_days_date = now.date()
+    
+    def refresh_sales_velocity(self):
+        """Precompute per-SKU sales velocity over the last 30 days (the window moves when the date rolls over)"""
+        now = datetime.now()
+        if self._velocity_date == now.date():
+            return
+        self._velocity_date = now.date()
+        start = self.sales_data['date'].searchsorted(now - timedelta(days=30))
+        recent = self.sales_data.iloc[start:]
+        daily_units = recent.groupby(['sku', 'date'])['quantity_sold'].sum()
+        self.avg_daily_by_sku = daily_units.groupby(level='sku').mean()
+        self.monthly_units_by_sku = recent.groupby('sku')['quantity_sold'].sum()
+        self._data_version += 1
+    
     def create_enhanced_pricing_data(self):
         """Create enhanced data: demand elasticity, competitor pricing, promotion history"""
         print("Creating enhanced pricing data...")
         
-        np.random.seed(42)
+        rng = np.random.default_rng(42)  # local generator, no global seeding
+        skus = self.inventory_data['sku'].unique()
+        n_skus = len(skus)
         
         # INPUT 1: DEMAND ELASTICITY (NEW - was missing!)
         # Measures how demand changes with price
-        self.demand_elasticity = pd.DataFrame({
-            'sku': self.inventory_data['sku'].unique(),
-            'price_elasticity': np.random.uniform(-2.5, -0.5, len(self.inventory_data['sku'].unique())),
-            # Negative elasticity: price ↑ → demand ↓
-            # -2.5 = highly elastic (luxury items)
-            # -0.5 = inelastic (essential medicines)
-            'elasticity_category': ''
-        })
+        # Negative elasticity: price ↑ → demand ↓
+        # -2.5 = highly elastic (luxury items)
+        # -0.5 = inelastic (essential medicines)
+        price_elasticity = rng.uniform(-2.5, -0.5, n_skus).astype(np.float32)
         
         # Categorize elasticity
-        self.demand_elasticity['elasticity_category'] = self.demand_elasticity['price_elasticity'].apply(
-            lambda x: 'Highly Elastic' if x < -2.0 else 'Moderately Elastic' if x < -1.5 else 'Inelastic'
-        )
+        # < -2.0 Highly Elastic, < -1.5 Moderately Elastic, else Inelastic
+        elasticity_category = pd.cut(
+            price_elasticity,
+            bins=[-np.inf, -2.0, -1.5, np.inf], right=False,
+            labels=ELASTICITY_CATEGORIES[::-1]
+        ).reorder_categories(ELASTICITY_CATEGORIES)
         
-        # INPUT 2: COMPETITOR PRICING (NEW - was missing!)
-        self.competitor_pricing = pd.DataFrame({
-            'sku': self.inventory_data['sku'].unique(),
-            'our_price': [self.inventory_data[self.inventory_data['sku'] == sku]['unit_price'].iloc[0] 
-                         for sku in self.inventory_data['sku'].unique()],
-            'competitor_avg_price': 0.0,
-            'price_position': '',
-            'competitor_count': np.random.randint(2, 6, len(self.inventory_data['sku'].unique()))
+        self.demand_elasticity = pd.DataFrame({
+            'sku': skus,
+            'price_elasticity': price_elasticity,
+            'elasticity_category': elasticity_category
         })
         
+        # INPUT 2: COMPETITOR PRICING (NEW - was missing!)
+        # First listed price per SKU (drop_duplicates keeps unique() order)
+        our_price = self.inventory_data.drop_duplicates('sku')['unit_price'].to_numpy()
+        competitor_count = rng.integers(2, 6, n_skus, dtype=np.int32)
+        
         # Calculate competitor prices (± 15% of our price)
-        self.competitor_pricing['competitor_avg_price'] = self.competitor_pricing['our_price'] * \
-                                                          np.random.uniform(0.85, 1.15, len(self.competitor_pricing))
+        competitor_price = our_price * rng.uniform(0.85, 1.15, n_skus)
         
         # Determine price position
-        self.competitor_pricing['price_position'] = self.competitor_pricing.apply(
-            lambda row: 'Premium' if row['our_price'] > row['competitor_avg_price'] * 1.05 
-            else 'Competitive' if row['our_price'] >= row['competitor_avg_price'] * 0.95
-            else 'Discount', axis=1
+        price_position = pd.Categorical(
+            np.select(
+                [our_price > competitor_price * 1.05, our_price >= competitor_price * 0.95],
+                ['Premium', 'Competitive'],
+                default='Discount'
+            ),
+            categories=PRICE_POSITIONS, ordered=True
         )
         
+        self.competitor_pricing = pd.DataFrame({
+            'sku': skus,
+            'our_price': our_price,
+            'competitor_avg_price': competitor_price,
+            'price_position': price_position,
+            'competitor_count': competitor_count
+        })
+        
         # INPUT 3: PROMOTION EFFECTIVENESS HISTORY
+        # Generate historical promotion data: every SKU x discount level
+        n_promo = min(10, n_skus)  # Sample for demo
+        discount_levels = np.array([5, 10, 15, 20, 25], dtype=np.int32)
+        sku_col = np.repeat(skus[:n_promo], len(discount_levels))
+        discount_col = np.tile(discount_levels, n_promo)
+        
+        # Sales uplift depends on elasticity
+        elasticity = np.repeat(price_elasticity[:n_promo], len(discount_levels))
+        uplift = np.abs(elasticity) * discount_col * (1 + rng.uniform(-0.2, 0.2, len(sku_col)).astype(np.float32))
+        
         self.promotion_history = pd.DataFrame({
-            'sku': [],
-            'discount_pct': [],
-            'sales_uplift_pct': [],
-            'margin_impact_pct': []
+            'sku': sku_col,
+            'discount_pct': discount_col,
+            'sales_uplift_pct': uplift.round(1),
+            'margin_impact_pct': (-discount_col * np.float32(0.7)).round(1)  # Simplified
         })
         
-        # Generate historical promotion data
-        for sku in self.inventory_data['sku'].unique()[:10]:  # Sample for demo
-            for discount in [5, 10, 15, 20, 25]:
-                # Sales uplift depends on elasticity
-                elasticity = self.demand_elasticity[self.demand_elasticity['sku'] == sku]['price_elasticity'].iloc[0]
-                uplift = abs(elasticity) * discount * (1 + np.random.uniform(-0.2, 0.2))
-                
-                self.promotion_history = pd.concat([self.promotion_history, pd.DataFrame([{
-                    'sku': sku,
-                    'discount_pct': discount,
-                    'sales_uplift_pct': round(uplift, 1),
-                    'margin_impact_pct': round(-discount * 0.7, 1)  # Simplified
-                }])], ignore_index=True)
+        # SKU-indexed views for O(1) per-SKU lookups
+        self._elast_ix = self.demand_elasticity.set_index('sku')
+        self._comp_ix = self.competitor_pricing.set_index('sku')
+        self._data_version += 1
         
         print(f"  ✓ Demand elasticity: {len(self.demand_elasticity)} products")
         print(f"  ✓ Competitor pricing: {len(self.competitor_pricing)} products")
         print(f"  ✓ Promotion history: {len(self.promotion_history)} records")
     
     def call_gemini_multi_key(self, prompt):
-        """Call Gemini API"""
+        """Call Gemini API, backing off rate-limited keys and dropping rejected ones"""
         for key_idx in range(len(API_KEYS)):
-            api_key = API_KEYS[(self.current_key_index + key_idx) % len(API_KEYS)]
-            client = genai.Client(api_key=api_key)
+            key_pos = (self.current_key_index + key_idx) % len(API_KEYS)
+            if key_pos in self._disabled_keys or time.time() < self._key_next_ok.get(key_pos, 0):
+                continue
+            client = self._clients[key_pos]
             
             for model_name in AVAILABLE_MODELS:
                 try:
@@ -166,47 +233,109 @@ class DiscountPricingAgent:
                         contents=prompt,
                         config=types.GenerateContentConfig(temperature=0.7)
                     )
+                    self.current_key_index = key_pos  # Start from the working key next time
+                    self._key_failures.pop(key_pos, None)
                     return response.text
-                except:
-                    continue
+                except errors.APIError as e:
+                    if e.code == 429:
+                        # Rate limited: rest this key for Retry-After or 2^n seconds
+                        failures = self._key_failures.get(key_pos, 0) + 1
+                        self._key_failures[key_pos] = failures
+                        retry_after = getattr(e.response, 'headers', {}).get('Retry-After')
+                        delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** failures
+                        self._key_next_ok[key_pos] = time.time() + delay
+                        break
+                    if e.code in (401, 403):
+                        # Invalid or unauthorized key: drop it for this process
+                        self._disabled_keys.add(key_pos)
+                        break
+                    if e.code == 404 or e.code >= 500:
+                        continue  # Model unavailable or transient server error
+                    return f"⚠️ API request rejected ({e.code})"
+                except httpx.HTTPError:
+                    continue  # Network error - try the next model/key
         return "⚠️ API unavailable"
     
     # ========================================================================
     # OUTPUT 1: SKU-Level Discount Recommendation (Enhanced with ALL inputs)
     # ========================================================================
     
-    def recommend_sku_discount_comprehensive(self, sku):
-        """Comprehensive SKU-level discount using ALL inputs"""
-        print(f"\n💰 COMPREHENSIVE SKU DISCOUNT RECOMMENDATION: {sku}")
-        print("=" * 80)
+    def recommend_sku_discount_comprehensive(self, sku, verbose=True):
+        """Comprehensive SKU-level discount using ALL inputs (memoized per data version)"""
+        if verbose:
+            print(f"\n💰 COMPREHENSIVE SKU DISCOUNT RECOMMENDATION: {sku}")
+            print("=" * 80)
+        
+        self.refresh_expiry_days()
+        self.refresh_sales_velocity()
+        cache_key = (sku, self._data_version, self._expiry_days_date, self.min_margin_pct)
+        cached = self._recommend_cache.get(cache_key)
+        if cached is None:
+            cached = self._compute_sku_discount(sku)
+            if cached is None:
+                return {"success": False, "message": "SKU not found"}
+            self._recommend_cache[cache_key] = cached
+            if len(self._recommend_cache) > RECOMMEND_CACHE_SIZE:
+                self._recommend_cache.popitem(last=False)
+        else:
+            self._recommend_cache.move_to_end(cache_key)
+        
+        result, days_of_supply, expected_sales_uplift_pct = cached
+        result = copy.deepcopy(result)  # callers may mutate their copy
+        
+        # Print recommendation
+        if not verbose:
+            return result
+        
+        inputs, impact = result['inputs_used'], result['impact']
+        print(f"\n📦 {result['product_name']}")
+        print(f"💵 Current Price: ${result['current_price']:.2f} | {inputs['price_position']} vs Market")
+        print(f"📊 Margin: {inputs['current_margin_pct']:.1f}%")
+        
+        print(f"\n📍 KEY INPUTS:")
+        print(f"  Demand Elasticity: {inputs['demand_elasticity']:.2f} ({inputs['elasticity_category']})")
+        print(f"  Competitor Price: ${inputs['competitor_avg_price']:.2f}")
+        print(f"  Days to Expiry: {inputs['days_to_expiry']}")
+        print(f"  Stock Supply: {days_of_supply:.0f} days")
+        
+        print(f"\n🎯 RECOMMENDATION:")
+        print(f"  Discount: {result['recommended_discount_pct']:.1f}%")
+        print(f"  New Price: ${result['discounted_price']:.2f}")
+        print(f"  New Margin: {impact['new_margin_pct']:.1f}%")
+        print(f"  Expected Sales Uplift: +{expected_sales_uplift_pct:.0f}%")
+        print(f"\n💡 Reason: {result['reason']}")
         
+        return result
+    
+    def _compute_sku_discount(self, sku):
+        """Discount decision for one SKU -> (result, days_of_supply, expected_sales_uplift_pct), or None"""
         # Get product data
-        product = self.inventory_data[self.inventory_data['sku'] == sku]
-        if len(product) == 0:
-            return {"success": False, "message": "SKU not found"}
+        try:
+            product = self._inv_ix.loc[[sku]]
+        except KeyError:
+            return None
         
         product_name = product['product_name'].iloc[0]
         current_price = product['unit_price'].iloc[0]
         current_stock = product['current_stock'].sum()
-        expiry_date = product['expiry_date'].iloc[0]
-        days_to_expiry = (expiry_date - datetime.now()).days
+        days_to_expiry = int(product['days_to_expiry'].iloc[0])
         
         # INPUT 1: Demand Elasticity
-        elasticity_data = self.demand_elasticity[self.demand_elasticity['sku'] == sku]
-        price_elasticity = elasticity_data['price_elasticity'].iloc[0] if len(elasticity_data) > 0 else -1.5
-        elasticity_category = elasticity_data['elasticity_category'].iloc[0] if len(elasticity_data) > 0 else 'Moderately Elastic'
+        try:
+            price_elasticity = float(self._elast_ix.at[sku, 'price_elasticity'])
+            elasticity_category = self._elast_ix.at[sku, 'elasticity_category']
+        except KeyError:
+            price_elasticity, elasticity_category = -1.5, 'Moderately Elastic'
         
         # INPUT 2: Competitor Pricing
-        comp_data = self.competitor_pricing[self.competitor_pricing['sku'] == sku]
-        competitor_price = comp_data['competitor_avg_price'].iloc[0] if len(comp_data) > 0 else current_price
-        price_position = comp_data['price_position'].iloc[0] if len(comp_data) > 0 else 'Competitive'
+        try:
+            competitor_price = self._comp_ix.at[sku, 'competitor_avg_price']
+            price_position = self._comp_ix.at[sku, 'price_position']
+        except KeyError:
+            competitor_price, price_position = current_price, 'Competitive'
         
         # INPUT 3: Stock Levels & Sales Velocity
-        recent_sales = self.sales_data[
-            (self.sales_data['sku'] == sku) &
-            (self.sales_data['date'] >= datetime.now() - timedelta(days=30))
-        ]
-        avg_daily_sales = recent_sales.groupby('date')['quantity_sold'].sum().mean() if len(recent_sales) > 0 else 0
+        avg_daily_sales = self.avg_daily_by_sku.get(sku, 0)
         days_of_supply = current_stock / avg_daily_sales if avg_daily_sales > 0 else 999
         
         # Calculate current margin
@@ -215,38 +344,33 @@ class DiscountPricingAgent:
         current_margin_pct = (current_margin / current_price) * 100
         
         # DECISION LOGIC (using ALL inputs)
-        recommended_discount = 0
-        reason_factors = []
-        
-        # Factor 1: Expiry Proximity
-        if days_to_expiry <= 30:
-            expiry_discount = min(30, (current_margin_pct - self.min_margin_pct))
-            recommended_discount = max(recommended_discount, expiry_discount)
-            reason_factors.append(f"Expiry in {days_to_expiry} days")
-        
-        # Factor 2: Competitor Pricing
-        if price_position == 'Premium':
-            price_gap_pct = ((current_price - competitor_price) / competitor_price) * 100
-            if price_gap_pct > 10:
-                comp_discount = min(price_gap_pct / 2, current_margin_pct - self.min_margin_pct)
-                recommended_discount = max(recommended_discount, comp_discount)
-                reason_factors.append(f"Price {price_gap_pct:.0f}% above market")
-        
-        # Factor 3: Overstocking
-        if days_of_supply > 90:
-            stock_discount = min(15, current_margin_pct - self.min_margin_pct)
-            recommended_discount = max(recommended_discount, stock_discount)
-            reason_factors.append(f"Overstocked ({days_of_supply:.0f} days supply)")
-        
-        # Factor 4: Demand Elasticity
-        # If highly elastic, small discount = big sales boost
-        if elasticity_category == 'Highly Elastic' and recommended_discount == 0:
-            recommended_discount = 5  # Small discount for elastic products
-            reason_factors.append("High price sensitivity - small discount drives sales")
-        
-        # Cap discount to protect margins
-        max_allowable_discount = current_margin_pct - self.min_margin_pct
-        recommended_discount = min(recommended_discount, max_allowable_discount)
+        # One candidate discount per factor; the recommendation is their max
+        max_allowable_discount = current_margin_pct - self.min_margin_pct  # Cap to protect margins
+        price_gap_pct = ((current_price - competitor_price) / competitor_price) * 100
+        active = np.array([
+            days_to_expiry <= 30,                                  # Factor 1: Expiry Proximity
+            price_position == 'Premium' and price_gap_pct > 10,    # Factor 2: Competitor Pricing
+            days_of_supply > 90,                                   # Factor 3: Overstocking
+            False                                                  # Factor 4: Demand Elasticity
+        ])
+        candidates = np.where(active, [min(30, max_allowable_discount),
+                                       min(price_gap_pct / 2, max_allowable_discount),
+                                       min(15, max_allowable_discount),
+                                       0], 0)
+        
+        # If highly elastic, small discount = big sales boost (only when nothing else applies)
+        if elasticity_category == 'Highly Elastic' and candidates.max() <= 0:
+            active[3], candidates[3] = True, 5
+        
+        recommended_discount = float(min(max(candidates.max(), 0), max_allowable_discount))
+        
+        reasons = [
+            f"Expiry in {days_to_expiry} days",
+            f"Price {price_gap_pct:.0f}% above market",
+            f"Overstocked ({days_of_supply:.0f} days supply)",
+            "High price sensitivity - small discount drives sales"
+        ]
+        reason_factors = [reason for reason, on in zip(reasons, active) if on]
         
         # Calculate impacts using elasticity
         discounted_price = current_price * (1 - recommended_discount/100)
@@ -279,54 +403,100 @@ class DiscountPricingAgent:
             "reason": " | ".join(reason_factors) if reason_factors else "Optimal pricing maintained"
         }
         
-        # Print recommendation
-        print(f"\n📦 {product_name}")
-        print(f"💵 Current Price: ${current_price:.2f} | {price_position} vs Market")
-        print(f"📊 Margin: {current_margin_pct:.1f}%")
+        return result, days_of_supply, expected_sales_uplift_pct
+    
+    def recommend_all_skus(self):
+        """Discount recommendation for every SKU in one vectorized pass (same rules as above)"""
+        self.refresh_expiry_days()
+        self.refresh_sales_velocity()
+        products = self.inventory_data.drop_duplicates('sku').set_index('sku')
+        skus = products.index
+        
+        current_price = products['unit_price'].to_numpy()
+        current_stock = self._inv_ix.groupby(level='sku', sort=False)['current_stock'].sum().reindex(skus).to_numpy()
+        days_to_expiry = products['days_to_expiry'].to_numpy()
+        
+        elasticity = self._elast_ix.reindex(skus)
+        price_elasticity = elasticity['price_elasticity'].fillna(-1.5).to_numpy()
+        elasticity_category = elasticity['elasticity_category'].fillna('Moderately Elastic').to_numpy()
+        
+        competitors = self._comp_ix.reindex(skus)
+        competitor_price = competitors['competitor_avg_price'].fillna(products['unit_price']).to_numpy()
+        price_position = competitors['price_position'].fillna('Competitive').to_numpy()
+        
+        avg_daily_sales = self.avg_daily_by_sku.reindex(skus, fill_value=0).to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            days_of_supply = np.where(avg_daily_sales > 0, current_stock / avg_daily_sales, 999)
+        
+        estimated_cost = current_price * 0.70
+        current_margin_pct = ((current_price - estimated_cost) / current_price) * 100
+        max_allowable_discount = current_margin_pct - self.min_margin_pct
         
-        print(f"\n📍 KEY INPUTS:")
-        print(f"  Demand Elasticity: {price_elasticity:.2f} ({elasticity_category})")
-        print(f"  Competitor Price: ${competitor_price:.2f}")
-        print(f"  Days to Expiry: {days_to_expiry}")
-        print(f"  Stock Supply: {days_of_supply:.0f} days")
+        # Candidate discount per factor (0 when the factor does not apply)
+        price_gap_pct = ((current_price - competitor_price) / competitor_price) * 100
+        expiry_discount = np.where(days_to_expiry <= 30, np.minimum(30, max_allowable_discount), 0)
+        comp_discount = np.where((price_position == 'Premium') & (price_gap_pct > 10),
+                                 np.minimum(price_gap_pct / 2, max_allowable_discount), 0)
+        stock_discount = np.where(days_of_supply > 90, np.minimum(15, max_allowable_discount), 0)
+        recommended_discount = np.maximum.reduce([np.zeros(len(skus)), expiry_discount, comp_discount, stock_discount])
         
-        print(f"\n🎯 RECOMMENDATION:")
-        print(f"  Discount: {recommended_discount:.1f}%")
-        print(f"  New Price: ${discounted_price:.2f}")
-        print(f"  New Margin: {new_margin_pct:.1f}%")
-        print(f"  Expected Sales Uplift: +{expected_sales_uplift_pct:.0f}%")
-        print(f"\n💡 Reason: {result['reason']}")
+        # Small discount for elastic products with no other trigger
+        recommended_discount = np.where((elasticity_category == 'Highly Elastic') & (recommended_discount == 0),
+                                        5, recommended_discount)
+        recommended_discount = np.minimum(recommended_discount, max_allowable_discount)
         
-        return result
+        discounted_price = current_price * (1 - recommended_discount / 100)
+        new_margin_pct = ((discounted_price - estimated_cost) / discounted_price) * 100
+        
+        return pd.DataFrame({
+            'sku': skus,
+            'product_name': products['product_name'].to_numpy(),
+            'current_price': current_price.round(2),
+            'recommended_discount_pct': recommended_discount.round(1),
+            'discounted_price': discounted_price.round(2),
+            'demand_elasticity': price_elasticity.round(2),
+            'elasticity_category': elasticity_category,
+            'competitor_avg_price': competitor_price.round(2),
+            'price_position': price_position,
+            'days_to_expiry': days_to_expiry.astype(int),
+            'days_of_supply': days_of_supply.round(1),
+            'current_margin_pct': current_margin_pct.round(1),
+            'new_margin_pct': new_margin_pct.round(1),
+            'margin_change': (new_margin_pct - current_margin_pct).round(1),
+            'expected_sales_uplift_pct': (np.abs(price_elasticity) * recommended_discount).round(1)
+        })
     
     # ========================================================================
     # OUTPUT 2: Bundle/Combination Offers
     # ========================================================================
     
-    def generate_bundle_offers(self):
+    def generate_bundle_offers(self, verbose=True):
         """Generate smart bundle recommendations"""
-        print("\n🎁 BUNDLE OFFER RECOMMENDATIONS")
-        print("=" * 80)
+        if verbose:
+            print("\n🎁 BUNDLE OFFER RECOMMENDATIONS")
+            print("=" * 80)
         
         # Find frequently bought together
         bundles = []
         
-        daily_baskets = self.sales_data.groupby('date')['sku'].apply(list).reset_index()
-        
-        from itertools import combinations
-        pair_counts = {}
-        
-        for basket in daily_baskets['sku']:
-            if len(basket) >= 2:
-                for pair in combinations(set(basket), 2):
-                    pair = tuple(sorted(pair))
-                    pair_counts[pair] = pair_counts.get(pair, 0) + 1
-        
-        top_pairs = sorted(pair_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-        
-        for (sku1, sku2), count in top_pairs:
-            prod1 = self.inventory_data[self.inventory_data['sku'] == sku1].iloc[0]
-            prod2 = self.inventory_data[self.inventory_data['sku'] == sku2].iloc[0]
+        # Count the days each pair of distinct SKUs sold together: a date x SKU
+        # presence matrix on integer codes, co-occurrence = presence.T @ presence
+        date_codes, _ = pd.factorize(self.sales_data['date'])
+        sku_codes, sku_names = pd.factorize(self.sales_data['sku'], sort=True)
+        presence = np.zeros((date_codes.max() + 1, len(sku_names)), dtype=np.int32)
+        presence[date_codes, sku_codes] = 1
+        co_counts = presence.T @ presence
+        
+        # Upper triangle = pairs with sku_1 < sku_2; top 5, ties in SKU order
+        first, second = np.triu_indices(len(sku_names), k=1)
+        pair_counts = co_counts[first, second]
+        top = np.argsort(-pair_counts, kind='stable')[:5]
+        top = top[pair_counts[top] > 0]
+        top_pairs = zip(sku_names[first[top]], sku_names[second[top]], pair_counts[top])
+        
+        for sku1, sku2, count in top_pairs:
+            prod1 = self._inv_ix.loc[[sku1]].iloc[0]
+            prod2 = self._inv_ix.loc[[sku2]].iloc[0]
             
             total_price = prod1['unit_price'] + prod2['unit_price']
             bundle_discount = 10  # 10% bundle discount
@@ -341,15 +511,16 @@ class DiscountPricingAgent:
                 'price_2': round(prod2['unit_price'], 2),
                 'bundle_price': round(bundle_price, 2),
                 'savings': round(total_price - bundle_price, 2),
-                'bought_together_count': count
+                'bought_together_count': int(count)
             })
         
-        print(f"\n🎯 TOP {len(bundles)} BUNDLE OPPORTUNITIES:")
-        for i, bundle in enumerate(bundles, 1):
-            print(f"\n{i}. {bundle['product_1']} + {bundle['product_2']}")
-            print(f"   Regular: ${bundle['price_1']:.2f} + ${bundle['price_2']:.2f} = ${bundle['price_1'] + bundle['price_2']:.2f}")
-            print(f"   Bundle: ${bundle['bundle_price']:.2f} (Save ${bundle['savings']:.2f})")
-            print(f"   Frequency: Bought together {bundle['bought_together_count']} times")
+        if verbose:
+            print(f"\n🎯 TOP {len(bundles)} BUNDLE OPPORTUNITIES:")
+            for i, bundle in enumerate(bundles, 1):
+                print(f"\n{i}. {bundle['product_1']} + {bundle['product_2']}")
+                print(f"   Regular: ${bundle['price_1']:.2f} + ${bundle['price_2']:.2f} = ${bundle['price_1'] + bundle['price_2']:.2f}")
+                print(f"   Bundle: ${bundle['bundle_price']:.2f} (Save ${bundle['savings']:.2f})")
+                print(f"   Frequency: Bought together {bundle['bought_together_count']} times")
         
         return {
             "success": True,
@@ -360,58 +531,53 @@ class DiscountPricingAgent:
     # OUTPUT 3: Clearance Pricing for Near-Expiry Stock
     # ========================================================================
     
-    def clearance_pricing_strategy(self, days_threshold=30):
+    def clearance_pricing_strategy(self, days_threshold=30, verbose=True):
         """Clearance pricing with margin protection"""
-        print(f"\n🔥 CLEARANCE PRICING STRATEGY (≤{days_threshold} days)")
-        print("=" * 80)
-        
-        near_expiry = self.inventory_data[
-            (self.inventory_data['expiry_date'] - datetime.now()).dt.days <= days_threshold
-        ].copy()
-        
-        near_expiry['days_to_expiry'] = (near_expiry['expiry_date'] - datetime.now()).dt.days
-        
-        clearance_items = []
-        
-        for _, item in near_expiry.iterrows():
-            cost = item['unit_price'] * 0.70
-            margin = item['unit_price'] - cost
-            margin_pct = (margin / item['unit_price']) * 100
-            
-            # Aggressive discount based on urgency
-            if item['days_to_expiry'] <= 7:
-                discount = min(40, margin_pct - 10)  # Max 40% or down to 10% margin
-                urgency = "🔴 CRITICAL"
-            elif item['days_to_expiry'] <= 14:
-                discount = min(30, margin_pct - 12)
-                urgency = "🟡 HIGH"
-            else:
-                discount = min(20, margin_pct - 15)
-                urgency = "🟢 MEDIUM"
-            
-            clearance_price = item['unit_price'] * (1 - discount/100)
-            potential_revenue = clearance_price * item['current_stock']
-            
-            clearance_items.append({
-                'sku': item['sku'],
-                'product_name': item['product_name'],
-                'days_to_expiry': int(item['days_to_expiry']),
-                'stock': int(item['current_stock']),
-                'original_price': round(item['unit_price'], 2),
-                'discount_pct': round(discount, 1),
-                'clearance_price': round(clearance_price, 2),
-                'potential_revenue': round(potential_revenue, 2),
-                'urgency': urgency
-            })
-        
-        clearance_items.sort(key=lambda x: x['days_to_expiry'])
-        
-        print(f"\n📊 {len(clearance_items)} ITEMS NEED CLEARANCE:")
-        for item in clearance_items[:10]:
-            print(f"\n{item['urgency']} {item['product_name']}")
-            print(f"  Expires: {item['days_to_expiry']} days | Stock: {item['stock']}")
-            print(f"  Price: ${item['original_price']:.2f} → ${item['clearance_price']:.2f} ({item['discount_pct']}% off)")
-            print(f"  Revenue: ${item['potential_revenue']:,.2f}")
+        if verbose:
+            print(f"\n🔥 CLEARANCE PRICING STRATEGY (≤{days_threshold} days)")
+            print("=" * 80)
+        
+        self.refresh_expiry_days()
+        near_expiry = self.inventory_data[self.inventory_data['days_to_expiry'] <= days_threshold]
+        
+        unit_price = near_expiry['unit_price']
+        cost = unit_price * 0.70
+        margin_pct = ((unit_price - cost) / unit_price) * 100
+        days_to_expiry = near_expiry['days_to_expiry'].to_numpy()
+        
+        # Aggressive discount based on urgency (critical discounts go down to a 10% margin)
+        tiers = [days_to_expiry <= 7, days_to_expiry <= 14]
+        discount = np.select(
+            tiers,
+            [np.minimum(40, margin_pct - 10), np.minimum(30, margin_pct - 12)],
+            default=np.minimum(20, margin_pct - 15)
+        )
+        urgency = np.select(tiers, ["🔴 CRITICAL", "🟡 HIGH"], default="🟢 MEDIUM")
+        
+        clearance_price = unit_price * (1 - discount / 100)
+        potential_revenue = clearance_price * near_expiry['current_stock']
+        
+        clearance_df = pd.DataFrame({
+            'sku': near_expiry['sku'],
+            'product_name': near_expiry['product_name'],
+            'days_to_expiry': near_expiry['days_to_expiry'].astype(int),
+            'stock': near_expiry['current_stock'].astype(int),
+            # Python round (exact decimal halves) rather than np.round, which can be a cent off
+            'original_price': [round(v, 2) for v in unit_price.tolist()],
+            'discount_pct': [round(v, 1) for v in discount.tolist()],
+            'clearance_price': [round(v, 2) for v in clearance_price.tolist()],
+            'potential_revenue': [round(v, 2) for v in potential_revenue.tolist()],
+            'urgency': pd.Categorical(urgency, categories=CLEARANCE_URGENCY_LEVELS)
+        }).sort_values('days_to_expiry', kind='stable')
+        clearance_items = clearance_df.to_dict('records')
+        
+        if verbose:
+            print(f"\n📊 {len(clearance_items)} ITEMS NEED CLEARANCE:")
+            for item in clearance_items[:10]:
+                print(f"\n{item['urgency']} {item['product_name']}")
+                print(f"  Expires: {item['days_to_expiry']} days | Stock: {item['stock']}")
+                print(f"  Price: ${item['original_price']:.2f} → ${item['clearance_price']:.2f} ({item['discount_pct']}% off)")
+                print(f"  Revenue: ${item['potential_revenue']:,.2f}")
         
         return {
             "success": True,
@@ -422,13 +588,15 @@ class DiscountPricingAgent:
     # OUTPUT 4: Margin Impact Simulation (NEW - was missing!)
     # ========================================================================
     
-    def simulate_margin_impact(self, sku, discount_scenarios=[0, 5, 10, 15, 20, 25]):
+    def simulate_margin_impact(self, sku, discount_scenarios=[0, 5, 10, 15, 20, 25], verbose=True):
         """Simulate margin impact across different discount levels"""
-        print(f"\n📊 MARGIN IMPACT SIMULATION: {sku}")
-        print("=" * 80)
+        if verbose:
+            print(f"\n📊 MARGIN IMPACT SIMULATION: {sku}")
+            print("=" * 80)
         
-        product = self.inventory_data[self.inventory_data['sku'] == sku]
-        if len(product) == 0:
+        try:
+            product = self._inv_ix.loc[[sku]]
+        except KeyError:
             return {"success": False, "message": "SKU not found"}
         
         product_name = product['product_name'].iloc[0]
@@ -436,66 +604,77 @@ class DiscountPricingAgent:
         current_stock = product['current_stock'].sum()
         
         # Get elasticity
-        elasticity_data = self.demand_elasticity[self.demand_elasticity['sku'] == sku]
-        price_elasticity = elasticity_data['price_elasticity'].iloc[0] if len(elasticity_data) > 0 else -1.5
+        try:
+            price_elasticity = float(self._elast_ix.at[sku, 'price_elasticity'])
+        except KeyError:
+            price_elasticity = -1.5
         
         # Get current sales
-        recent_sales = self.sales_data[
-            (self.sales_data['sku'] == sku) &
-            (self.sales_data['date'] >= datetime.now() - timedelta(days=30))
-        ]
-        current_monthly_units = recent_sales['quantity_sold'].sum()
+        self.refresh_sales_velocity()
+        current_monthly_units = self.monthly_units_by_sku.get(sku, 0)
         
         # Cost structure
         cost_per_unit = current_price * 0.70
         
-        simulations = []
+        # All scenarios at once
+        discounts = np.asarray(discount_scenarios, dtype=float)
+        new_price = current_price * (1 - discounts / 100)
         
-        for discount_pct in discount_scenarios:
-            # New price
-            new_price = current_price * (1 - discount_pct/100)
-            
-            # Revenue per unit
-            revenue_per_unit = new_price
-            
-            # Margin per unit
-            margin_per_unit = new_price - cost_per_unit
-            margin_pct = (margin_per_unit / new_price) * 100 if new_price > 0 else 0
-            
-            # Predict volume increase using elasticity
-            volume_increase_pct = abs(price_elasticity) * discount_pct
-            new_monthly_units = current_monthly_units * (1 + volume_increase_pct/100)
-            
-            # Total revenue and margin
-            total_revenue = new_price * new_monthly_units
-            total_margin = margin_per_unit * new_monthly_units
-            
-            # Compare to baseline (0% discount)
-            if discount_pct == 0:
-                baseline_revenue = total_revenue
-                baseline_margin = total_margin
-            
-            revenue_change_pct = ((total_revenue - baseline_revenue) / baseline_revenue * 100) if discount_pct > 0 else 0
-            margin_change_pct = ((total_margin - baseline_margin) / baseline_margin * 100) if discount_pct > 0 else 0
-            
-            simulations.append({
+        # Margin per unit
+        margin_per_unit = new_price - cost_per_unit
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margin_pct = np.where(new_price > 0, margin_per_unit / new_price * 100, 0)
+        
+        # Predict volume increase using elasticity
+        volume_increase_pct = abs(price_elasticity) * discounts
+        new_monthly_units = current_monthly_units * (1 + volume_increase_pct / 100)
+        
+        # Total revenue and margin
+        total_revenue = new_price * new_monthly_units
+        total_margin = margin_per_unit * new_monthly_units
+        
+        # Compare to baseline (0% discount)
+        baseline_revenue = current_price * current_monthly_units
+        baseline_margin = (current_price - cost_per_unit) * current_monthly_units
+        with np.errstate(divide='ignore', invalid='ignore'):
+            revenue_change_pct = np.where(discounts > 0, (total_revenue - baseline_revenue) / baseline_revenue * 100, 0)
+            margin_change_pct = np.where(discounts > 0, (total_margin - baseline_margin) / baseline_margin * 100, 0)
+        
+        simulations = [
+            {
                 'discount_pct': discount_pct,
-                'new_price': round(new_price, 2),
-                'margin_pct': round(margin_pct, 1),
-                'predicted_units': int(new_monthly_units),
-                'volume_increase_pct': round(volume_increase_pct, 1),
-                'total_revenue': round(total_revenue, 2),
-                'total_margin': round(total_margin, 2),
-                'revenue_vs_baseline_pct': round(revenue_change_pct, 1),
-                'margin_vs_baseline_pct': round(margin_change_pct, 1),
+                'new_price': round(price, 2),
+                'margin_pct': round(m_pct, 1),
+                'predicted_units': int(units),
+                'volume_increase_pct': round(volume_pct, 1),
+                'total_revenue': round(revenue, 2),
+                'total_margin': round(margin, 2),
+                'revenue_vs_baseline_pct': round(revenue_change, 1),
+                'margin_vs_baseline_pct': round(margin_change, 1),
                 'recommended': False
-            })
+            }
+            for discount_pct, price, m_pct, units, volume_pct, revenue, margin, revenue_change, margin_change
+            in zip(discount_scenarios, new_price, margin_pct, new_monthly_units, volume_increase_pct,
+                   total_revenue, total_margin, revenue_change_pct, margin_change_pct)
+        ]
         
         # Find optimal discount (maximize total margin)
-        best_scenario = max(simulations, key=lambda x: x['total_margin'])
+        best_scenario = simulations[int(np.argmax([sim['total_margin'] for sim in simulations]))]
         best_scenario['recommended'] = True
         
+        result = {
+            "success": True,
+            "sku": sku,
+            "product_name": product_name,
+            "simulations": simulations,
+            "optimal_discount": best_scenario['discount_pct'],
+            "optimal_margin": best_scenario['total_margin']
+        }
+        
         # Print simulation
+        if not verbose:
+            return result
+        
         print(f"\n📦 {product_name}")
         print(f"💵 Current Price: ${current_price:.2f} | Monthly Volume: {current_monthly_units:.0f} units")
         print(f"📊 Elasticity: {price_elasticity:.2f}")
@@ -510,14 +689,55 @@ class DiscountPricingAgent:
         
         print(f"\n⭐ OPTIMAL: {best_scenario['discount_pct']:.0f}% discount maximizes total margin")
         
-        return {
-            "success": True,
-            "sku": sku,
-            "product_name": product_name,
-            "simulations": simulations,
-            "optimal_discount": best_scenario['discount_pct'],
-            "optimal_margin": best_scenario['total_margin']
-        }
+        return result
+    
+    def simulate_all_margin_impacts(self, discount_scenarios=[0, 5, 10, 15, 20, 25]):
+        """Margin simulation for every SKU x discount level in one vectorized pass (same model as above)"""
+        products = self.inventory_data.drop_duplicates('sku').set_index('sku')
+        skus = products.index
+        
+        current_price = products['unit_price'].to_numpy()[:, None]
+        price_elasticity = self._elast_ix['price_elasticity'].reindex(skus).fillna(-1.5).to_numpy()[:, None]
+        self.refresh_sales_velocity()
+        current_monthly_units = self.monthly_units_by_sku.reindex(skus, fill_value=0).to_numpy()[:, None]
+        cost_per_unit = current_price * 0.70
+        
+        # SKU x discount grid
+        discounts = np.asarray(discount_scenarios, dtype=float)[None, :]
+        new_price = current_price * (1 - discounts / 100)
+        margin_per_unit = new_price - cost_per_unit
+        volume_increase_pct = np.abs(price_elasticity) * discounts
+        new_monthly_units = current_monthly_units * (1 + volume_increase_pct / 100)
+        total_revenue = new_price * new_monthly_units
+        total_margin = margin_per_unit * new_monthly_units
+        
+        baseline_revenue = current_price * current_monthly_units
+        baseline_margin = (current_price - cost_per_unit) * current_monthly_units
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margin_pct = np.where(new_price > 0, margin_per_unit / new_price * 100, 0)
+            revenue_change_pct = np.where(discounts > 0, (total_revenue - baseline_revenue) / baseline_revenue * 100, 0)
+            margin_change_pct = np.where(discounts > 0, (total_margin - baseline_margin) / baseline_margin * 100, 0)
+        
+        # Optimal discount per SKU maximizes (rounded) total margin
+        total_margin = total_margin.round(2)
+        recommended = np.zeros(total_margin.shape, dtype=bool)
+        recommended[np.arange(len(skus)), total_margin.argmax(axis=1)] = True
+        
+        n_scenarios = discounts.shape[1]
+        return pd.DataFrame({
+            'sku': np.repeat(skus.to_numpy(), n_scenarios),
+            'product_name': np.repeat(products['product_name'].to_numpy(), n_scenarios),
+            'discount_pct': np.tile(np.asarray(discount_scenarios), len(skus)),
+            'new_price': new_price.round(2).ravel(),
+            'margin_pct': margin_pct.round(1).ravel(),
+            'predicted_units': new_monthly_units.astype(int).ravel(),
+            'volume_increase_pct': np.broadcast_to(volume_increase_pct, total_margin.shape).round(1).ravel(),
+            'total_revenue': total_revenue.round(2).ravel(),
+            'total_margin': total_margin.ravel(),
+            'revenue_vs_baseline_pct': revenue_change_pct.round(1).ravel(),
+            'margin_vs_baseline_pct': margin_change_pct.round(1).ravel(),
+            'recommended': recommended.ravel()
+        })
 
 
 def main():
@@ -30,27 +30,72 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import os
+import random
+import time
+import httpx
 from dotenv import load_dotenv
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 
 load_dotenv()
 
-# Load ALL available API keys
-API_KEYS = []
-for i in range(1, 10):
-    if i == 1:
-        key = os.getenv("GEMINI_API_KEY")
-    else:
-        key = os.getenv(f"GEMINI_API_KEY_{i}")
-    
-    if key:
-        API_KEYS.append(key)
+def _api_key_number(name):
+    """Position of a GEMINI_API_KEY / GEMINI_API_KEY_<n> variable, None for anything else"""
+    if name == "GEMINI_API_KEY":
+        return 1
+    suffix = name[len("GEMINI_API_KEY_"):]
+    return int(suffix) if name.startswith("GEMINI_API_KEY_") and suffix.isdigit() else None
+
+# Load ALL available API keys in one pass over the environment, in key-number order
+_numbered_keys = [(_api_key_number(name), key) for name, key in os.environ.items()]
+API_KEYS = [key for number, key in sorted(k for k in _numbered_keys if k[0] is not None and k[1])]
 
 if not API_KEYS:
     raise ValueError("No GEMINI_API_KEY found!")
 
 AVAILABLE_MODELS = ['gemini-2.0-flash', 'gemini-1.5-flash', 'gemini-2.5-flash']
+KEY_COOLDOWN_SECONDS = 30  # Rest a rate-limited key this long (plus jitter)
+
+INVENTORY_CSV = "data/current_inventory.csv"
+INVENTORY_PARQUET = "data/current_inventory.parquet"  # Columnar cache of INVENTORY_CSV
+SALES_CSV = "data/sales_history.csv"
+SALES_PARQUET = "data/sales_history.parquet"  # Columnar cache of SALES_CSV
+SALES_COLUMNS = ['date', 'sku', 'product_name', 'quantity_sold', 'store_id']  # all this agent reads
+
+# Safety stock parameters
+LEAD_TIME_DAYS = 7  # Supplier lead time
+SERVICE_LEVEL = 0.95  # 95% service level
+Z_SCORE = 1.65  # For 95% service level
+MIN_SALES_RECORDS = 30  # Minimum sales history for safety stock
+
+CATEGORICAL_COLUMNS = ['sku', 'store_id', 'product_name']
+NO_ROWS = np.array([], dtype=np.intp)  # lookup result for unknown SKUs/stores
+NS_PER_DAY = 86_400_000_000_000
+
+
+def _read_cached_csv(csv_path, parquet_path, date_column, columns=None):
+    """Read the parquet copy of a CSV unless the CSV has been regenerated since, else parse and refresh it"""
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path):
+        return pd.read_parquet(parquet_path, columns=columns)
+    
+    data = pd.read_csv(csv_path, parse_dates=[date_column])
+    try:
+        data.to_parquet(parquet_path, index=False)
+    except OSError:
+        pass  # Read-only data directory - keep using the CSV
+    return data if columns is None else data[columns]
+
+
+def _grouped_demand_stats(values, offsets):
+    """Mean, sample std and max of each run values[offsets[g]:offsets[g + 1]]"""
+    starts = offsets[:-1]
+    counts = np.diff(offsets)
+    mean = np.add.reduceat(values, starts) / counts
+    squared_dev = (values - np.repeat(mean, counts)) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(np.add.reduceat(squared_dev, starts) / (counts - 1))
+    std[counts < 2] = np.nan
+    return mean, std, np.maximum.reduceat(values, starts)
 
 
 class InventoryOptimizationAgent:
@@ -66,6 +111,8 @@ class InventoryOptimizationAgent:
         print("=" * 80)
         
         self.current_key_index = 0
+        self._clients = [genai.Client(api_key=key) for key in API_KEYS]
+        self._key_cooldown = {}  # key position -> time.time() when it may be retried
         self.inventory_data = None
         self.sales_data = None
         self.load_data()
@@ -76,24 +123,65 @@ class InventoryOptimizationAgent:
         """Load inventory and sales data"""
         try:
             print("Loading data...")
-            self.inventory_data = pd.read_csv("data/current_inventory.csv")
-            self.inventory_data['expiry_date'] = pd.to_datetime(self.inventory_data['expiry_date'])
+            self.inventory_data = _read_cached_csv(INVENTORY_CSV, INVENTORY_PARQUET, 'expiry_date')
             print(f"  ✓ Loaded {len(self.inventory_data):,} inventory records")
             
-            self.sales_data = pd.read_csv("data/sales_history.csv")
-            self.sales_data['date'] = pd.to_datetime(self.sales_data['date'])
+            self.sales_data = _read_cached_csv(SALES_CSV, SALES_PARQUET, 'date', columns=SALES_COLUMNS)
             print(f"  ✓ Loaded {len(self.sales_data):,} sales records")
             
+            # Shared categorical dtype per key column, so groupbys/merges work on integer codes
+            for col in CATEGORICAL_COLUMNS:
+                key_dtype = pd.CategoricalDtype(sorted(set(self.inventory_data[col]) | set(self.sales_data[col])))
+                self.inventory_data[col] = self.inventory_data[col].astype(key_dtype)
+                self.sales_data[col] = self.sales_data[col].astype(key_dtype)
+            self.inventory_data['current_stock'] = self.inventory_data['current_stock'].astype('int32')
+            self.sales_data['quantity_sold'] = self.sales_data['quantity_sold'].astype('int32')
+            
+            # Row positions per key, so per-SKU/store lookups skip the full-column scan
+            self._inv_rows_by_sku = self.inventory_data.groupby('sku', sort=False, observed=True).indices
+            self._inv_rows_by_store = self.inventory_data.groupby('store_id', sort=False, observed=True).indices
+            self._sales_rows_by_sku = self.sales_data.groupby('sku', sort=False, observed=True).indices
+            self._features_cache = {}  # shared per-SKU aggregates, rebuilt on reload
+            self._expiry_ns = self.inventory_data['expiry_date'].to_numpy().view('int64')  # integer day math
+            # Rows ordered by expiry, so "expiring by X" is a binary search plus a prefix
+            self._expiry_order = np.argsort(self._expiry_ns, kind='stable')
+            self._expiry_sorted_ns = self._expiry_ns[self._expiry_order]
+            
+            # Units and sales records per (sku, store, date), aggregated once for all capabilities
+            self._daily_sales = self.sales_data.groupby(['sku', 'store_id', 'date'], observed=True).agg(
+                units=('quantity_sold', 'sum'),
+                records=('quantity_sold', 'size')
+            )
+            self._sales_days = self._daily_sales.index.get_level_values('date')
+            
         except FileNotFoundError:
             print("\n❌ ERROR: Data files not found!")
             print("Run: python generate_sample_data.py")
             raise
     
+    def _feature(self, name, build):
+        """Shared aggregate reused across capabilities (built once per data load)"""
+        if name not in self._features_cache:
+            self._features_cache[name] = build()
+        return self._features_cache[name]
+    
+    def _inventory_by_sku(self):
+        """Per-SKU stock summary, in inventory order"""
+        return self.inventory_data.groupby('sku', sort=False, observed=True).agg(
+            product_name=('product_name', 'first'),
+            total_stock=('current_stock', 'sum'),
+            unit_price=('unit_price', 'first'),
+            stores_count=('store_id', 'size')
+        )
+    
     def call_gemini_multi_key(self, prompt):
-        """Try multiple API keys until one works"""
+        """Try multiple API keys until one works, skipping keys that are cooling down"""
+        start_index = self.current_key_index
         for key_idx in range(len(API_KEYS)):
-            api_key = API_KEYS[(self.current_key_index + key_idx) % len(API_KEYS)]
-            client = genai.Client(api_key=api_key)
+            key_pos = (start_index + key_idx) % len(API_KEYS)
+            if time.time() < self._key_cooldown.get(key_pos, 0):
+                continue
+            client = self._clients[key_pos]
             
             for model_name in AVAILABLE_MODELS:
                 try:
@@ -102,49 +190,61 @@ class InventoryOptimizationAgent:
                         contents=prompt,
                         config=types.GenerateContentConfig(temperature=0.7)
                     )
-                    self.current_key_index = (self.current_key_index + key_idx) % len(API_KEYS)
+                    self.current_key_index = key_pos  # start from the working key next time
                     return response.text
-                except Exception as e:
-                    if any(x in str(e) for x in ['429', 'RESOURCE_EXHAUSTED', '404']):
-                        continue
-        return f"⚠️ All API keys at capacity."
+                except errors.APIError as e:
+                    if e.code == 429:
+                        # Quota hit: rest this key and move on to the next one
+                        self._key_cooldown[key_pos] = time.time() + KEY_COOLDOWN_SECONDS + random.uniform(0, 5)
+                        break
+                    if e.code == 404 or e.code >= 500:
+                        continue  # Model unavailable or transient server error
+                    return f"⚠️ API request failed ({e.code})"
+                except httpx.HTTPError:
+                    continue  # Network error - try the next model/key
+        return "⚠️ All API keys at capacity."
     
     # ========================================================================
     # CAPABILITY 1: Current Stock Visibility Across Stores/Warehouse
     # ========================================================================
     
-    def get_stock_visibility_comprehensive(self, sku=None, store_id=None):
+    def get_stock_visibility_comprehensive(self, sku=None, store_id=None, verbose=True):
         """Real-time stock visibility across all locations"""
-        print("\n📊 COMPREHENSIVE STOCK VISIBILITY")
-        print("=" * 80)
+        if verbose:
+            print("\n📊 COMPREHENSIVE STOCK VISIBILITY")
+            print("=" * 80)
         
-        data = self.inventory_data.copy()
+        data = self.inventory_data
         
+        rows = None
         if sku:
-            data = data[data['sku'] == sku]
+            rows = self._inv_rows_by_sku.get(sku, NO_ROWS)
         if store_id:
-            data = data[data['store_id'] == store_id]
+            store_rows = self._inv_rows_by_store.get(store_id, NO_ROWS)
+            rows = store_rows if rows is None else np.intersect1d(rows, store_rows)
+        if rows is not None:
+            data = data.iloc[rows]
         
         if len(data) == 0:
             return {"success": False, "message": "No inventory found"}
         
+        stock_value = data['current_stock'].to_numpy() * data['unit_price'].to_numpy()
+        
         # Overall metrics
         total_stock = data['current_stock'].sum()
-        total_value = (data['current_stock'] * data['unit_price']).sum()
+        total_value = stock_value.sum()
         stores_count = data['store_id'].nunique()
         products_count = data['sku'].nunique()
         
         # By location
-        by_location = data.groupby('store_id').agg({
-            'current_stock': 'sum',
-            'sku': 'count',
-            'unit_price': lambda x: (data[data['store_id'] == x.name]['current_stock'] * 
-                                     data[data['store_id'] == x.name]['unit_price']).sum()
-        }).reset_index()
-        by_location.columns = ['store_id', 'total_units', 'product_count', 'inventory_value']
+        by_location = data[['store_id', 'current_stock', 'sku']].assign(stock_value=stock_value).groupby('store_id', observed=True).agg(
+            total_units=('current_stock', 'sum'),
+            product_count=('sku', 'count'),
+            inventory_value=('stock_value', 'sum')
+        ).reset_index()
         
         # By product
-        by_product = data.groupby(['sku', 'product_name']).agg({
+        by_product = data.groupby(['sku', 'product_name'], observed=True).agg({
             'current_stock': 'sum',
             'unit_price': 'first',
             'store_id': 'count'
@@ -152,16 +252,18 @@ class InventoryOptimizationAgent:
         by_product['total_value'] = by_product['current_stock'] * by_product['unit_price']
         by_product.columns = ['sku', 'product_name', 'total_stock', 'unit_price', 'stores_count', 'total_value']
         by_product = by_product.sort_values('total_value', ascending=False)
+        location_records = by_location.to_dict('records')
         
-        print(f"\n📈 OVERALL METRICS:")
-        print(f"  Total Stock: {total_stock:,.0f} units")
-        print(f"  Total Value: ${total_value:,.2f}")
-        print(f"  Stores: {stores_count}")
-        print(f"  Products: {products_count}")
+        if verbose:
+            print(f"\n📈 OVERALL METRICS:")
+            print(f"  Total Stock: {total_stock:,.0f} units")
+            print(f"  Total Value: ${total_value:,.2f}")
+            print(f"  Stores: {stores_count}")
+            print(f"  Products: {products_count}")
         
-        print(f"\n🏪 BY LOCATION:")
-        for _, row in by_location.head(5).iterrows():
-            print(f"  Store {row['store_id']}: {row['total_units']:,.0f} units | ${row['inventory_value']:,.2f}")
+            print(f"\n🏪 BY LOCATION:")
+            for row in location_records[:5]:
+                print(f"  Store {row['store_id']}: {row['total_units']:,.0f} units | ${row['inventory_value']:,.2f}")
         
         return {
             "success": True,
@@ -171,7 +273,7 @@ class InventoryOptimizationAgent:
                 "stores_count": int(stores_count),
                 "products_count": int(products_count)
             },
-            "by_location": by_location.to_dict('records'),
+            "by_location": location_records,
             "by_product": by_product.head(10).to_dict('records')
         }
     
@@ -179,14 +281,15 @@ class InventoryOptimizationAgent:
     # CAPABILITY 2: Safety Stock Calculation
     # ========================================================================
     
-    def calculate_safety_stock(self, sku):
+    def calculate_safety_stock(self, sku, verbose=True):
         """Calculate optimal safety stock level using statistical methods"""
-        print(f"\n🛡️ SAFETY STOCK CALCULATION: {sku}")
-        print("=" * 80)
+        if verbose:
+            print(f"\n🛡️ SAFETY STOCK CALCULATION: {sku}")
+            print("=" * 80)
         
-        sku_sales = self.sales_data[self.sales_data['sku'] == sku].copy()
+        sku_sales = self.sales_data.iloc[self._sales_rows_by_sku.get(sku, NO_ROWS)]
         
-        if len(sku_sales) < 30:
+        if len(sku_sales) < MIN_SALES_RECORDS:
             return {"success": False, "message": "Insufficient sales history"}
         
         product_name = sku_sales['product_name'].iloc[0]
@@ -199,9 +302,9 @@ class InventoryOptimizationAgent:
         max_daily_demand = daily_sales.max()
         
         # Parameters
-        lead_time_days = 7  # Supplier lead time
-        service_level = 0.95  # 95% service level
-        z_score = 1.65  # For 95% service level
+        lead_time_days = LEAD_TIME_DAYS
+        service_level = SERVICE_LEVEL
+        z_score = Z_SCORE
         
         # Safety stock formula: Z × StdDev × √Lead Time
         safety_stock = z_score * std_daily_demand * np.sqrt(lead_time_days)
@@ -212,17 +315,18 @@ class InventoryOptimizationAgent:
         # Maximum inventory level
         max_stock = reorder_point + (avg_daily_demand * lead_time_days)
         
-        print(f"\n📦 {product_name}")
-        print(f"\n📊 DEMAND STATISTICS:")
-        print(f"  Avg Daily Demand: {avg_daily_demand:.1f} units")
-        print(f"  StdDev: {std_daily_demand:.1f} units")
-        print(f"  Max Daily: {max_daily_demand:.0f} units")
+        if verbose:
+            print(f"\n📦 {product_name}")
+            print(f"\n📊 DEMAND STATISTICS:")
+            print(f"  Avg Daily Demand: {avg_daily_demand:.1f} units")
+            print(f"  StdDev: {std_daily_demand:.1f} units")
+            print(f"  Max Daily: {max_daily_demand:.0f} units")
         
-        print(f"\n🎯 INVENTORY PARAMETERS:")
-        print(f"  Safety Stock: {safety_stock:.0f} units")
-        print(f"  Reorder Point: {reorder_point:.0f} units")
-        print(f"  Max Stock Level: {max_stock:.0f} units")
-        print(f"  Service Level: {service_level*100:.0f}%")
+            print(f"\n🎯 INVENTORY PARAMETERS:")
+            print(f"  Safety Stock: {safety_stock:.0f} units")
+            print(f"  Reorder Point: {reorder_point:.0f} units")
+            print(f"  Max Stock Level: {max_stock:.0f} units")
+            print(f"  Service Level: {service_level*100:.0f}%")
         
         return {
             "success": True,
@@ -242,57 +346,89 @@ class InventoryOptimizationAgent:
             }
         }
     
+    def _safety_stock_table(self):
+        """Demand statistics and safety stock parameters for every SKU in one pass"""
+        history = pd.DataFrame({
+            'sales_records': self._daily_sales['records'].groupby(level='sku', observed=True).sum(),
+            'product_name': self.sales_data.drop_duplicates('sku').set_index('sku')['product_name']
+        })
+        daily_sales = self._daily_sales['units'].groupby(level=['sku', 'date'], observed=True).sum()
+        
+        # Sorted (sku, date) index -> each SKU's daily demand is one contiguous run
+        sku_codes = daily_sales.index.codes[0]
+        group_codes, starts = np.unique(sku_codes, return_index=True)
+        mean, std, peak = _grouped_demand_stats(daily_sales.to_numpy(dtype=float), np.append(starts, len(sku_codes)))
+        stats = history.join(pd.DataFrame({'mean': mean, 'std': std, 'max': peak},
+                                          index=daily_sales.index.levels[0][group_codes]))
+        stats = stats[stats['sales_records'] >= MIN_SALES_RECORDS]
+        
+        safety_stock = Z_SCORE * stats['std'] * np.sqrt(LEAD_TIME_DAYS)
+        reorder_point = (stats['mean'] * LEAD_TIME_DAYS) + safety_stock
+        max_stock = reorder_point + (stats['mean'] * LEAD_TIME_DAYS)
+        
+        # Rounded exactly as calculate_safety_stock reports them
+        return pd.DataFrame({
+            'product_name': stats['product_name'],
+            'avg_daily': stats['mean'].round(2),
+            'std_dev': stats['std'].round(2),
+            'max_daily': stats['max'].round(0),
+            'safety_stock': safety_stock.round(0),
+            'reorder_point': reorder_point.round(0),
+            'max_stock': max_stock.round(0)
+        })
+    
     # ========================================================================
     # CAPABILITY 3: Expiry Tracking & Near-Expiry Alerts
     # ========================================================================
     
-    def track_expiry_comprehensive(self, days_threshold=90):
+    def track_expiry_comprehensive(self, days_threshold=90, verbose=True):
         """Track items nearing expiry with detailed alerts"""
-        print(f"\n⚠️ EXPIRY TRACKING (Next {days_threshold} days)")
-        print("=" * 80)
+        if verbose:
+            print(f"\n⚠️ EXPIRY TRACKING (Next {days_threshold} days)")
+            print("=" * 80)
         
-        today = datetime.now()
-        threshold_date = today + timedelta(days=days_threshold)
+        today_ns = pd.Timestamp(datetime.now()).value
         
-        # Find expiring items
-        expiring = self.inventory_data[
-            self.inventory_data['expiry_date'] <= threshold_date
-        ].copy()
+        # Find expiring items (kept in inventory order)
+        n_expiring = np.searchsorted(self._expiry_sorted_ns, today_ns + days_threshold * NS_PER_DAY, side='right')
+        rows = np.sort(self._expiry_order[:n_expiring])
+        expiring = self.inventory_data.iloc[rows].copy()
         
-        expiring['days_to_expiry'] = (expiring['expiry_date'] - today).dt.days
+        # Whole days to expiry as int64 nanosecond arithmetic (floors like Timedelta.days)
+        expiring['days_to_expiry'] = (self._expiry_ns[rows] - today_ns) // NS_PER_DAY
         expiring['expiry_value'] = expiring['current_stock'] * expiring['unit_price']
         
-        # Categorize by urgency
-        critical = expiring[expiring['days_to_expiry'] <= 30]  # Critical: ≤30 days
-        warning = expiring[(expiring['days_to_expiry'] > 30) & (expiring['days_to_expiry'] <= 60)]
-        watch = expiring[expiring['days_to_expiry'] > 60]
+        # Categorize by urgency: Critical ≤30 days, Warning 31-60, Watch >60
+        urgency = pd.cut(expiring['days_to_expiry'], bins=[-np.inf, 30, 60, np.inf],
+                         labels=['critical', 'warning', 'watch'])
+        by_urgency = expiring['expiry_value'].groupby(urgency, observed=False).agg(['count', 'sum'])
+        critical = expiring[(urgency == 'critical').to_numpy()]
         
-        print(f"\n📊 EXPIRY SUMMARY:")
-        print(f"  🔴 Critical (≤30 days): {len(critical)} items | ${critical['expiry_value'].sum():,.2f}")
-        print(f"  🟡 Warning (31-60 days): {len(warning)} items | ${warning['expiry_value'].sum():,.2f}")
-        print(f"  🟢 Watch (61-90 days): {len(watch)} items | ${watch['expiry_value'].sum():,.2f}")
-        print(f"  💰 Total at Risk: ${expiring['expiry_value'].sum():,.2f}")
+        if verbose:
+            print(f"\n📊 EXPIRY SUMMARY:")
+            print(f"  🔴 Critical (≤30 days): {by_urgency.at['critical', 'count']} items | ${by_urgency.at['critical', 'sum']:,.2f}")
+            print(f"  🟡 Warning (31-60 days): {by_urgency.at['warning', 'count']} items | ${by_urgency.at['warning', 'sum']:,.2f}")
+            print(f"  🟢 Watch (61-90 days): {by_urgency.at['watch', 'count']} items | ${by_urgency.at['watch', 'sum']:,.2f}")
+            print(f"  💰 Total at Risk: ${expiring['expiry_value'].sum():,.2f}")
         
         # Liquidation alerts
-        liquidation_alerts = []
-        for _, item in critical.iterrows():
-            liquidation_alerts.append({
-                'sku': item['sku'],
-                'product_name': item['product_name'],
-                'store_id': item['store_id'],
-                'stock': int(item['current_stock']),
-                'days_to_expiry': int(item['days_to_expiry']),
-                'value_at_risk': round(item['expiry_value'], 2),
-                'recommended_action': 'IMMEDIATE CLEARANCE' if item['days_to_expiry'] <= 7 else 'DISCOUNT 20-30%'
-            })
+        liquidation_alerts = pd.DataFrame({
+            'sku': critical['sku'],
+            'product_name': critical['product_name'],
+            'store_id': critical['store_id'],
+            'stock': critical['current_stock'].astype(int),
+            'days_to_expiry': critical['days_to_expiry'].astype(int),
+            'value_at_risk': critical['expiry_value'].round(2),
+            'recommended_action': np.where(critical['days_to_expiry'] <= 7, 'IMMEDIATE CLEARANCE', 'DISCOUNT 20-30%')
+        }).to_dict('records')
         
         return {
             "success": True,
             "summary": {
                 "total_expiring": len(expiring),
-                "critical_count": len(critical),
-                "warning_count": len(warning),
-                "watch_count": len(watch),
+                "critical_count": int(by_urgency.at['critical', 'count']),
+                "warning_count": int(by_urgency.at['warning', 'count']),
+                "watch_count": int(by_urgency.at['watch', 'count']),
                 "total_value_at_risk": round(expiring['expiry_value'].sum(), 2)
             },
             "liquidation_alerts": liquidation_alerts,
@@ -303,58 +439,54 @@ class InventoryOptimizationAgent:
     # CAPABILITY 4: Auto-Reorder Suggestions Based on Forecast
     # ========================================================================
     
-    def generate_reorder_recommendations(self, top_n=10):
+    def generate_reorder_recommendations(self, top_n=10, verbose=True):
         """Auto-reorder suggestions with optimal quantities"""
-        print(f"\n🔄 AUTO-REORDER RECOMMENDATIONS (Top {top_n})")
-        print("=" * 80)
-        
-        recommendations = []
-        
-        for sku in self.inventory_data['sku'].unique():
-            # Calculate safety stock
-            safety_calc = self.calculate_safety_stock(sku)
-            
-            if not safety_calc['success']:
-                continue
-            
-            # Get current stock across all stores
-            current_stock = self.inventory_data[
-                self.inventory_data['sku'] == sku
-            ]['current_stock'].sum()
-            
-            reorder_point = safety_calc['inventory_params']['reorder_point']
-            safety_stock = safety_calc['inventory_params']['safety_stock']
-            avg_daily_demand = safety_calc['demand_stats']['avg_daily']
-            
-            # Check if reorder needed
-            if current_stock <= reorder_point:
-                days_remaining = current_stock / avg_daily_demand if avg_daily_demand > 0 else 999
-                urgency = days_remaining
-                
-                # Economic Order Quantity (simplified)
-                order_qty = max(reorder_point + safety_stock - current_stock, 
-                               avg_daily_demand * 14)  # At least 2 weeks supply
-                
-                recommendations.append({
-                    'sku': sku,
-                    'product_name': safety_calc['product_name'],
-                    'current_stock': round(current_stock, 0),
-                    'reorder_point': round(reorder_point, 0),
-                    'recommended_order_qty': round(order_qty, 0),
-                    'days_remaining': round(days_remaining, 1),
-                    'urgency_score': round(urgency, 2),
-                    'priority': 'URGENT' if days_remaining < 3 else 'HIGH' if days_remaining < 7 else 'NORMAL'
-                })
+        if verbose:
+            print(f"\n🔄 AUTO-REORDER RECOMMENDATIONS (Top {top_n})")
+            print("=" * 80)
+        
+        # Safety stock for every SKU at once, in inventory order
+        params = self._feature('safety_stock', self._safety_stock_table)
+        stock = self._feature('inventory_by_sku', self._inventory_by_sku)
+        params = params.reindex(stock.index.intersection(params.index, sort=False))
+        
+        # Get current stock across all stores
+        current_stock = stock['total_stock'].reindex(params.index)
+        
+        # Check if reorder needed
+        needs_reorder = (current_stock <= params['reorder_point']).to_numpy()
+        params, current_stock = params[needs_reorder], current_stock[needs_reorder].to_numpy()
+        reorder_point = params['reorder_point'].to_numpy()
+        safety_stock = params['safety_stock'].to_numpy()
+        avg_daily_demand = params['avg_daily'].to_numpy()
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            days_remaining = np.where(avg_daily_demand > 0, current_stock / avg_daily_demand, 999)
+        
+        # Economic Order Quantity (simplified), at least 2 weeks supply
+        order_qty = np.maximum(reorder_point + safety_stock - current_stock, avg_daily_demand * 14)
+        
+        recommendations = pd.DataFrame({
+            'sku': params.index,
+            'product_name': params['product_name'].to_numpy(),
+            'current_stock': current_stock,
+            'reorder_point': reorder_point,
+            'recommended_order_qty': order_qty.round(0),
+            'days_remaining': days_remaining.round(1),
+            'urgency_score': days_remaining.round(2),
+            'priority': np.select([days_remaining < 3, days_remaining < 7], ['URGENT', 'HIGH'], default='NORMAL')
+        })
         
         # Sort by urgency
-        recommendations.sort(key=lambda x: x['urgency_score'])
+        recommendations = recommendations.sort_values('urgency_score', kind='stable').to_dict('records')
         
-        print(f"\n🎯 {len(recommendations)} PRODUCTS NEED REORDERING:")
-        for i, rec in enumerate(recommendations[:top_n], 1):
-            print(f"\n{i}. {rec['priority']} - {rec['product_name']}")
-            print(f"   Current: {rec['current_stock']:.0f} | Reorder Point: {rec['reorder_point']:.0f}")
-            print(f"   Recommended Order: {rec['recommended_order_qty']:.0f} units")
-            print(f"   Days Remaining: {rec['days_remaining']:.1f}")
+        if verbose:
+            print(f"\n🎯 {len(recommendations)} PRODUCTS NEED REORDERING:")
+            for i, rec in enumerate(recommendations[:top_n], 1):
+                print(f"\n{i}. {rec['priority']} - {rec['product_name']}")
+                print(f"   Current: {rec['current_stock']:.0f} | Reorder Point: {rec['reorder_point']:.0f}")
+                print(f"   Recommended Order: {rec['recommended_order_qty']:.0f} units")
+                print(f"   Days Remaining: {rec['days_remaining']:.1f}")
         
         return {
             "success": True,
@@ -366,66 +498,70 @@ class InventoryOptimizationAgent:
     # CAPABILITY 5: Dead Stock Identification (NEW - was missing!)
     # ========================================================================
     
-    def identify_dead_stock(self, days_no_sales=90, min_stock_value=100):
+    def identify_dead_stock(self, days_no_sales=90, min_stock_value=100, verbose=True):
         """Identify dead stock - items with no sales and low movement"""
-        print(f"\n💀 DEAD STOCK IDENTIFICATION")
-        print(f"Criteria: No sales in {days_no_sales} days + Min value ${min_stock_value}")
-        print("=" * 80)
-        
-        cutoff_date = datetime.now() - timedelta(days=days_no_sales)
-        
-        dead_stock = []
-        
-        for sku in self.inventory_data['sku'].unique():
-            # Check recent sales
-            recent_sales = self.sales_data[
-                (self.sales_data['sku'] == sku) & 
-                (self.sales_data['date'] >= cutoff_date)
-            ]
-            
-            # If no recent sales
-            if len(recent_sales) == 0:
-                sku_inventory = self.inventory_data[self.inventory_data['sku'] == sku]
-                
-                total_stock = sku_inventory['current_stock'].sum()
-                unit_price = sku_inventory['unit_price'].iloc[0]
-                total_value = total_stock * unit_price
-                
-                # Only flag if value is significant
-                if total_value >= min_stock_value:
-                    # Check historical sales
-                    all_sales = self.sales_data[self.sales_data['sku'] == sku]
-                    last_sale_date = all_sales['date'].max() if len(all_sales) > 0 else None
-                    days_since_last_sale = (datetime.now() - last_sale_date).days if last_sale_date else 999
-                    
-                    dead_stock.append({
-                        'sku': sku,
-                        'product_name': sku_inventory['product_name'].iloc[0],
-                        'total_stock': int(total_stock),
-                        'unit_price': round(unit_price, 2),
-                        'total_value': round(total_value, 2),
-                        'days_since_last_sale': int(days_since_last_sale),
-                        'stores_count': len(sku_inventory),
-                        'recommended_action': self._get_dead_stock_action(days_since_last_sale, total_value)
-                    })
+        if verbose:
+            print(f"\n💀 DEAD STOCK IDENTIFICATION")
+            print(f"Criteria: No sales in {days_no_sales} days + Min value ${min_stock_value}")
+            print("=" * 80)
+        
+        now = datetime.now()
+        cutoff_date = now - timedelta(days=days_no_sales)
+        
+        # Recent sales count and last sale date per SKU in one pass
+        daily = self._daily_sales.assign(
+            recent_records=self._daily_sales['records'].where(self._sales_days >= cutoff_date, 0),
+            date=self._sales_days
+        )
+        sales_activity = daily.groupby(level='sku', observed=True).agg(
+            recent_count=('recent_records', 'sum'),
+            last_sale=('date', 'max')
+        )
+        
+        stock = self._feature('inventory_by_sku', self._inventory_by_sku).join(sales_activity)
+        stock['total_value'] = stock['total_stock'] * stock['unit_price']
+        
+        # No recent sales, and only flag if value is significant
+        dead = stock[(stock['recent_count'].fillna(0) == 0) & (stock['total_value'] >= min_stock_value)]
+        days_since_last_sale = (now - dead['last_sale']).dt.days.fillna(999).astype(int).to_numpy()
+        
+        # Action by staleness and value locked
+        dead_value = dead['total_value'].to_numpy()
+        recommended_action = np.select(
+            [(days_since_last_sale > 180) & (dead_value > 1000), days_since_last_sale > 180, days_since_last_sale > 120],
+            ["Return to supplier or heavy discount (40-50%)", "Liquidate or donate", "Aggressive discount (30-40%) or bundle"],
+            default="Monitor and consider promotion (20-30% discount)"
+        )
+        
+        dead_df = pd.DataFrame({
+            'sku': dead.index,
+            'product_name': dead['product_name'].to_numpy(),
+            'total_stock': dead['total_stock'].astype(int).to_numpy(),
+            'unit_price': dead['unit_price'].round(2).to_numpy(),
+            'total_value': dead['total_value'].round(2).to_numpy(),
+            'days_since_last_sale': days_since_last_sale,
+            'stores_count': dead['stores_count'].to_numpy(),
+            'recommended_action': recommended_action
+        })
         
         # Sort by value
-        dead_stock.sort(key=lambda x: x['total_value'], reverse=True)
+        dead_stock = dead_df.sort_values('total_value', ascending=False, kind='stable').to_dict('records')
         
         total_dead_value = sum(item['total_value'] for item in dead_stock)
         
-        print(f"\n📊 DEAD STOCK SUMMARY:")
-        print(f"  Total Items: {len(dead_stock)}")
-        print(f"  Total Value: ${total_dead_value:,.2f}")
-        print(f"  Working Capital Locked: ${total_dead_value:,.2f}")
+        if verbose:
+            print(f"\n📊 DEAD STOCK SUMMARY:")
+            print(f"  Total Items: {len(dead_stock)}")
+            print(f"  Total Value: ${total_dead_value:,.2f}")
+            print(f"  Working Capital Locked: ${total_dead_value:,.2f}")
         
-        if len(dead_stock) > 0:
-            print(f"\n🔝 TOP 10 DEAD STOCK ITEMS:")
-            for i, item in enumerate(dead_stock[:10], 1):
-                print(f"\n{i}. {item['product_name']}")
-                print(f"   Stock: {item['total_stock']} units | Value: ${item['total_value']:,.2f}")
-                print(f"   Last Sale: {item['days_since_last_sale']} days ago")
-                print(f"   Action: {item['recommended_action']}")
+            if len(dead_stock) > 0:
+                print(f"\n🔝 TOP 10 DEAD STOCK ITEMS:")
+                for i, item in enumerate(dead_stock[:10], 1):
+                    print(f"\n{i}. {item['product_name']}")
+                    print(f"   Stock: {item['total_stock']} units | Value: ${item['total_value']:,.2f}")
+                    print(f"   Last Sale: {item['days_since_last_sale']} days ago")
+                    print(f"   Action: {item['recommended_action']}")
         
         return {
             "success": True,
@@ -434,97 +570,69 @@ class InventoryOptimizationAgent:
             "dead_stock": dead_stock
         }
     
-    def _get_dead_stock_action(self, days_no_sale, value):
-        """Determine action for dead stock"""
-        if days_no_sale > 180:
-            if value > 1000:
-                return "Return to supplier or heavy discount (40-50%)"
-            else:
-                return "Liquidate or donate"
-        elif days_no_sale > 120:
-            return "Aggressive discount (30-40%) or bundle"
-        else:
-            return "Monitor and consider promotion (20-30% discount)"
-    
     # ========================================================================
     # CAPABILITY 6: Stock Transfer Suggestions (Integration with Store Transfer Agent)
     # ========================================================================
     
-    def suggest_stock_transfers_integrated(self):
+    def suggest_stock_transfers_integrated(self, verbose=True):
         """Suggest inter-store transfers (integrates with Store Transfer Agent)"""
-        print(f"\n🔀 STOCK TRANSFER SUGGESTIONS")
-        print("=" * 80)
-        
-        transfer_suggestions = []
-        
-        # For each SKU, find imbalances
-        for sku in self.inventory_data['sku'].unique():
-            sku_inventory = self.inventory_data[self.inventory_data['sku'] == sku]
-            
-            if len(sku_inventory) < 2:
-                continue  # Need at least 2 stores
-            
-            product_name = sku_inventory['product_name'].iloc[0]
-            
-            # Get sales velocity per store
-            sku_sales = self.sales_data[self.sales_data['sku'] == sku]
-            recent_sales = sku_sales[sku_sales['date'] >= datetime.now() - timedelta(days=30)]
-            
-            store_velocities = {}
-            for store_id in sku_inventory['store_id'].unique():
-                store_sales = recent_sales[recent_sales['store_id'] == store_id]
-                velocity = store_sales.groupby('date')['quantity_sold'].sum().mean() if len(store_sales) > 0 else 0
-                store_velocities[store_id] = velocity
-            
-            # Find overstocked and understocked
-            for _, row in sku_inventory.iterrows():
-                store_id = row['store_id']
-                current_stock = row['current_stock']
-                velocity = store_velocities.get(store_id, 0)
-                
-                days_of_supply = current_stock / velocity if velocity > 0 else 999
-                
-                # Overstocked: >60 days supply
-                # Understocked: <7 days supply
-                
-                if days_of_supply > 60 and velocity > 0:
-                    # Find understocked stores for same SKU
-                    for other_store, other_velocity in store_velocities.items():
-                        if other_store == store_id:
-                            continue
-                        
-                        other_stock = sku_inventory[sku_inventory['store_id'] == other_store]['current_stock'].iloc[0]
-                        other_days = other_stock / other_velocity if other_velocity > 0 else 999
-                        
-                        if other_days < 14:  # Understocked
-                            transfer_qty = min(current_stock * 0.5, other_velocity * 14)
-                            
-                            if transfer_qty >= 10:
-                                transfer_suggestions.append({
-                                    'sku': sku,
-                                    'product_name': product_name,
-                                    'from_store': store_id,
-                                    'to_store': other_store,
-                                    'transfer_quantity': int(transfer_qty),
-                                    'from_days_supply': round(days_of_supply, 1),
-                                    'to_days_supply': round(other_days, 1),
-                                    'reason': 'Balance inventory across stores',
-                                    'priority': 'HIGH' if other_days < 7 else 'MEDIUM'
-                                })
+        if verbose:
+            print(f"\n🔀 STOCK TRANSFER SUGGESTIONS")
+            print("=" * 80)
+        
+        # Sales velocity per (SKU, store): mean daily units over the last 30 days
+        is_recent = self._sales_days >= datetime.now() - timedelta(days=30)
+        velocity = self._daily_sales.loc[is_recent, 'units'] \
+                                    .groupby(level=['sku', 'store_id'], observed=True).mean().rename('velocity')
+        
+        # SKU-major order, as the suggestions are listed per SKU
+        stock = self.inventory_data[['sku', 'product_name', 'store_id', 'current_stock']]
+        stock = stock.iloc[np.argsort(pd.factorize(stock['sku'])[0], kind='stable')]
+        stock = stock.join(velocity, on=['sku', 'store_id'])
+        stock['velocity'] = stock['velocity'].fillna(0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stock['days_of_supply'] = np.where(stock['velocity'] > 0, stock['current_stock'] / stock['velocity'], 999)
+        
+        # Overstocked: >60 days supply
+        # Understocked: <14 days supply
+        donors = stock[(stock['days_of_supply'] > 60) & (stock['velocity'] > 0)]
+        recipients = stock.drop_duplicates(['sku', 'store_id'])
+        recipients = recipients[recipients['days_of_supply'] < 14]  # filter both sides before joining
+        pairs = donors.merge(recipients[['sku', 'store_id', 'velocity', 'days_of_supply']],
+                             on='sku', suffixes=('_from', '_to'))
+        pairs = pairs[pairs['store_id_from'] != pairs['store_id_to']]
+        
+        transfer_qty = np.minimum(pairs['current_stock'] * 0.5, pairs['velocity_to'] * 14)
+        pairs, transfer_qty = pairs[transfer_qty >= 10], transfer_qty[transfer_qty >= 10]
+        first_rows = stock.drop_duplicates('sku')
+        product_names = dict(zip(first_rows['sku'], first_rows['product_name']))
+        
+        transfer_suggestions = pd.DataFrame({
+            'sku': pairs['sku'],
+            'product_name': pairs['sku'].map(product_names),
+            'from_store': pairs['store_id_from'],
+            'to_store': pairs['store_id_to'],
+            'transfer_quantity': transfer_qty.astype(int),
+            'from_days_supply': pairs['days_of_supply_from'].round(1),
+            'to_days_supply': pairs['days_of_supply_to'].round(1),
+            'reason': 'Balance inventory across stores',
+            'priority': np.where(pairs['days_of_supply_to'] < 7, 'HIGH', 'MEDIUM')
+        }).to_dict('records')
         
         # Sort by priority
         transfer_suggestions.sort(key=lambda x: (x['priority'] == 'HIGH', x['to_days_supply']))
         
-        print(f"\n📊 TRANSFER SUGGESTIONS: {len(transfer_suggestions)}")
+        if verbose:
+            print(f"\n📊 TRANSFER SUGGESTIONS: {len(transfer_suggestions)}")
         
-        if len(transfer_suggestions) > 0:
-            print(f"\n🔝 TOP 10 TRANSFER OPPORTUNITIES:")
-            for i, sugg in enumerate(transfer_suggestions[:10], 1):
-                print(f"\n{i}. {sugg['priority']} - {sugg['product_name']}")
-                print(f"   From Store {sugg['from_store']} ({sugg['from_days_supply']:.0f} days) → Store {sugg['to_store']} ({sugg['to_days_supply']:.0f} days)")
-                print(f"   Transfer: {sugg['transfer_quantity']} units")
-        else:
-            print("\n✅ Inventory is balanced - no transfers needed")
+            if len(transfer_suggestions) > 0:
+                print(f"\n🔝 TOP 10 TRANSFER OPPORTUNITIES:")
+                for i, sugg in enumerate(transfer_suggestions[:10], 1):
+                    print(f"\n{i}. {sugg['priority']} - {sugg['product_name']}")
+                    print(f"   From Store {sugg['from_store']} ({sugg['from_days_supply']:.0f} days) → Store {sugg['to_store']} ({sugg['to_days_supply']:.0f} days)")
+                    print(f"   Transfer: {sugg['transfer_quantity']} units")
+            else:
+                print("\n✅ Inventory is balanced - no transfers needed")
         
         return {
             "success": True,
@@ -18,8 +18,10 @@ COST: $0 (Uses FREE Gemini API)
 
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
+import hashlib
+from collections import OrderedDict
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
@@ -27,16 +29,55 @@ from collections import Counter
 
 load_dotenv()
 
-API_KEYS = []
-for i in range(1, 10):
-    if i == 1:
-        key = os.getenv("GEMINI_API_KEY")
-    else:
-        key = os.getenv(f"GEMINI_API_KEY_{i}")
-    if key:
-        API_KEYS.append(key)
+# GEMINI_API_KEY, GEMINI_API_KEY_2 ... GEMINI_API_KEY_9, read in one pass
+API_KEY_NAMES = ('GEMINI_API_KEY',) + tuple(f'GEMINI_API_KEY_{i}' for i in range(2, 10))
+API_KEYS = tuple(key for key in map(os.environ.get, API_KEY_NAMES) if key)
 
 AVAILABLE_MODELS = ['gemini-2.0-flash', 'gemini-1.5-flash']
+LLM_CACHE_SIZE = 256  # Most recent prompt responses kept in memory
+_CLIENTS = {}  # API key -> genai.Client, see _gemini_client
+
+# Prescription/doctor columns stored as categoricals (all low-cardinality group keys)
+CATEGORICAL_COLUMNS = ['doctor_id', 'specialty', 'clinic', 'location', 'medicine_prescribed', 'patient_age_group']
+
+# Location action text for _get_location_actions
+CHRONIC_ACTION = "Stock 30-day supplies for chronic medications"
+SPECIALTY_ACTIONS = {
+    'Cardiologist': "Promote heart health supplements",
+    'Diabetologist': "Stock diabetic care products",
+    'Pediatrician': "Focus on children's medicines and vitamins"
+}
+CLINIC_PARTNER_ACTION = "Partner with local clinics for prescription fulfillment"
+
+DOCTORS_PARQUET = "data/prescription_doctors.parquet"  # Same-day cache of the synthetic doctors
+PRESCRIPTIONS_PARQUET = "data/prescriptions.parquet"  # Same-day cache of the synthetic prescriptions
+
+
+def _gemini_client(api_key):
+    """One client (and connection pool) per API key, shared by every agent instance"""
+    client = _CLIENTS.get(api_key)
+    if client is None:
+        client = _CLIENTS[api_key] = genai.Client(api_key=api_key)
+    return client
+
+
+def _ranked_value_counts(frame, key, column):
+    """value_counts of column within each key group, most common first (ties in first-seen order)"""
+    counts = frame.groupby([key, column], sort=False, observed=True).size()
+    return counts.sort_values(ascending=False, kind='stable')
+
+
+def _top_k_counts(values, k):
+    """The k most common values with their counts (ties, including at the cut-off, in category order)"""
+    counts = values.value_counts(sort=False)
+    counts = counts[counts > 0]  # categorical value_counts also lists unused categories
+    return counts.sort_values(ascending=False, kind='stable').head(k)
+
+
+def _top_per_group(frame, key, column):
+    """Most common column value within each key group, as {key: value}"""
+    ranked = _ranked_value_counts(frame, key, column)
+    return dict(ranked.groupby(level=key, sort=False, observed=True).head(1).index)
 
 
 class PrescriptionIntelligenceAgent:
@@ -52,6 +93,7 @@ class PrescriptionIntelligenceAgent:
         print("=" * 80)
         
         self.current_key_index = 0
+        self._llm_cache = OrderedDict()  # SHA-256 of prompt -> response text
         self.create_prescription_data()
         
         print("✅ Agent initialized!\n")
@@ -60,8 +102,6 @@ class PrescriptionIntelligenceAgent:
         """Create comprehensive prescription data with clinic/location details"""
         print("Creating prescription intelligence data...")
         
-        np.random.seed(42)
-        
         # Locations with clinics
         self.locations = {
             'Mumbai': ['Fortis Hospital', 'Apollo Clinic', 'Lilavati Hospital', 'KEM Hospital'],
@@ -71,34 +111,6 @@ class PrescriptionIntelligenceAgent:
             'Chennai': ['Apollo Chennai', 'MIOT Hospital', 'Fortis Malar', 'Kauvery Hospital']
         }
         
-        # Doctors by specialty and location
-        self.doctors_data = []
-        doctor_id = 1
-        
-        for location, clinics in self.locations.items():
-            for clinic in clinics:
-                # Each clinic has 3-5 doctors
-                num_doctors = np.random.randint(3, 6)
-                for _ in range(num_doctors):
-                    specialty = np.random.choice([
-                        'General Physician', 'Cardiologist', 'Diabetologist',
-                        'Orthopedic', 'Pediatrician', 'Dermatologist'
-                    ])
-                    
-                    self.doctors_data.append({
-                        'doctor_id': f'DR{doctor_id:03d}',
-                        'doctor_name': f'Dr. {np.random.choice(["Sharma", "Patel", "Kumar", "Singh", "Reddy"])} {doctor_id}',
-                        'specialty': specialty,
-                        'clinic': clinic,
-                        'location': location,
-                        'patients_per_day': np.random.randint(15, 40),
-                        'prescriptions_per_patient': np.random.uniform(1.5, 3.0),
-                        'years_experience': np.random.randint(5, 30)
-                    })
-                    doctor_id += 1
-        
-        self.doctors_df = pd.DataFrame(self.doctors_data)
-        
         # Prescription patterns by specialty
         self.specialty_patterns = {
             'General Physician': ['Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Azithromycin'],
@@ -109,44 +121,149 @@ class PrescriptionIntelligenceAgent:
             'Dermatologist': ['Cetaphil', 'Adapalene', 'Fluconazole', 'Hydrocortisone']
         }
         
-        # Generate prescription records
-        prescription_records = []
-        
-        for _ in range(2000):  # 2000 prescriptions
-            doctor = self.doctors_df.sample(1).iloc[0]
-            
-            # Medicines based on specialty
-            medicines = self.specialty_patterns.get(doctor['specialty'], ['Generic Medicine'])
-            prescribed_medicine = np.random.choice(medicines)
-            
-            prescription_records.append({
-                'prescription_id': f'RX{np.random.randint(10000, 99999)}',
-                'date': datetime.now() - timedelta(days=np.random.randint(1, 90)),
-                'doctor_id': doctor['doctor_id'],
-                'doctor_name': doctor['doctor_name'],
-                'specialty': doctor['specialty'],
-                'clinic': doctor['clinic'],
-                'location': doctor['location'],
-                'medicine_prescribed': prescribed_medicine,
-                'quantity': np.random.randint(10, 60),
-                'patient_age_group': np.random.choice(['0-18', '19-35', '36-50', '51-65', '65+']),
-                'chronic_condition': np.random.choice([True, False], p=[0.3, 0.7]),
-                'refill_expected': np.random.choice([True, False], p=[0.4, 0.6])
-            })
-        
-        self.prescription_df = pd.DataFrame(prescription_records)
-        self.prescription_df['date'] = pd.to_datetime(self.prescription_df['date'])
+        loaded = self._load_cached_prescription_data()
+        if not loaded:
+            self._generate_prescription_data()
+        
+        # Low-cardinality group keys as categoricals (integer-code groupbys, less memory)
+        for frame in (self.prescription_df, self.doctors_df):
+            for column in CATEGORICAL_COLUMNS:
+                if column in frame:
+                    frame[column] = frame[column].astype('category')
+        
+        if loaded:
+            print("  ✓ Loaded from today's parquet cache")
+        else:
+            try:
+                self.doctors_df.to_parquet(DOCTORS_PARQUET, index=False)
+                self.prescription_df.to_parquet(PRESCRIPTIONS_PARQUET, index=False)
+            except OSError:
+                pass  # Read-only data directory - regenerate next time
+        self._build_aggregates()
         
         print(f"  ✓ Doctors: {len(self.doctors_df)}")
         print(f"  ✓ Clinics: {sum(len(clinics) for clinics in self.locations.values())}")
         print(f"  ✓ Locations: {len(self.locations)}")
         print(f"  ✓ Prescriptions: {len(self.prescription_df):,}")
     
+    def _build_aggregates(self):
+        """Per-location and per-clinic aggregates shared by the capabilities (rebuilt with the data)"""
+        rx = self.prescription_df
+        self._behavior_cache = {}  # (location, specialty) -> analyze_doctor_prescribing_behavior aggregates
+        
+        # Medicine rankings within each location
+        self._location_medicines = _ranked_value_counts(rx, 'location', 'medicine_prescribed')
+        
+        by_location = rx.groupby('location', sort=False, observed=True).agg(
+            rx_count=('prescription_id', 'count'),
+            first_date=('date', 'min'),
+            last_date=('date', 'max'),
+            clinics_count=('clinic', 'nunique'),
+            doctors_count=('doctor_id', 'nunique'),
+            chronic_rate=('chronic_condition', 'mean')
+        )
+        by_location['chronic_rate'] *= 100
+        by_location['top_specialty'] = by_location.index.map(_top_per_group(rx, 'location', 'specialty'))
+        by_location['dominant_age_group'] = by_location.index.map(_top_per_group(rx, 'location', 'patient_age_group'))
+        
+        by_clinic = rx.groupby('clinic', sort=False, observed=True).agg(
+            location=('location', 'first'),
+            rx_count=('prescription_id', 'count'),
+            first_date=('date', 'min'),
+            last_date=('date', 'max'),
+            doctors=('doctor_id', 'nunique')
+        )
+        by_clinic['top_medicine'] = by_clinic.index.map(_top_per_group(rx, 'clinic', 'medicine_prescribed'))
+        
+        for stats in (by_location, by_clinic):
+            # Daily prescription rate over the observed date span
+            days_of_data = (stats['last_date'] - stats['first_date']).dt.days
+            stats['daily_rx_rate'] = (stats['rx_count'] / days_of_data).where(days_of_data > 0, 0)
+        
+        self._location_stats = by_location
+        self._clinic_stats = by_clinic
+    
+    def _load_cached_prescription_data(self):
+        """Load the doctors/prescriptions generated earlier today, if cached"""
+        today = datetime.now().date()
+        for path in (DOCTORS_PARQUET, PRESCRIPTIONS_PARQUET):
+            # Dates are relative to the generation day, so only same-day caches are reused
+            if not os.path.exists(path) or datetime.fromtimestamp(os.path.getmtime(path)).date() != today:
+                return False
+        self.doctors_df = pd.read_parquet(DOCTORS_PARQUET)
+        self.prescription_df = pd.read_parquet(PRESCRIPTIONS_PARQUET)
+        self.doctors_data = self.doctors_df.to_dict('records')
+        return True
+    
+    def _generate_prescription_data(self):
+        """Generate the synthetic doctors and prescription records (seeded)"""
+        np.random.seed(42)
+        
+        # Doctors by specialty and location: one array per field
+        clinics = [clinic for clinics in self.locations.values() for clinic in clinics]
+        clinic_locations = [location for location, clinics in self.locations.items() for _ in clinics]
+        
+        # Each clinic has 3-5 doctors
+        doctors_per_clinic = np.random.randint(3, 6, len(clinics))
+        n_doctors = doctors_per_clinic.sum()
+        doctor_numbers = np.arange(1, n_doctors + 1).astype(str)
+        last_names = np.random.choice(["Sharma", "Patel", "Kumar", "Singh", "Reddy"], n_doctors)
+        
+        self.doctors_df = pd.DataFrame({
+            'doctor_id': np.char.add('DR', np.char.zfill(doctor_numbers, 3)),
+            'doctor_name': np.char.add(np.char.add(np.char.add('Dr. ', last_names), ' '), doctor_numbers),
+            'specialty': np.random.choice([
+                'General Physician', 'Cardiologist', 'Diabetologist',
+                'Orthopedic', 'Pediatrician', 'Dermatologist'
+            ], n_doctors),
+            'clinic': np.repeat(clinics, doctors_per_clinic),
+            'location': np.repeat(clinic_locations, doctors_per_clinic),
+            'patients_per_day': np.random.randint(15, 40, n_doctors),
+            'prescriptions_per_patient': np.random.uniform(1.5, 3.0, n_doctors),
+            'years_experience': np.random.randint(5, 30, n_doctors)
+        })
+        self.doctors_data = self.doctors_df.to_dict('records')
+        
+        # Generate prescription records, one column at a time
+        n_prescriptions = 2000
+        doctors = self.doctors_df.iloc[np.random.randint(0, len(self.doctors_df), n_prescriptions)].reset_index(drop=True)
+        
+        # Medicines based on specialty: one uniform draw indexes a (specialty x medicine) table
+        specialty_codes, specialties = pd.factorize(doctors['specialty'])
+        pools = [self.specialty_patterns.get(specialty, ['Generic Medicine']) for specialty in specialties]
+        pool_sizes = np.array([len(pool) for pool in pools])
+        medicine_table = np.array([pool + [None] * (pool_sizes.max() - len(pool)) for pool in pools], dtype=object)
+        picks = (np.random.random_sample(n_prescriptions) * pool_sizes[specialty_codes]).astype(int)
+        prescribed_medicine = medicine_table[specialty_codes, picks]
+        
+        today = pd.Timestamp(datetime.now()).floor('D')
+        days_ago = np.random.randint(1, 90, n_prescriptions)
+        
+        self.prescription_df = pd.DataFrame({
+            'prescription_id': np.char.add('RX', np.random.randint(10000, 99999, n_prescriptions).astype(str)),
+            'date': today - pd.to_timedelta(days_ago, unit='D'),
+            'doctor_id': doctors['doctor_id'],
+            'doctor_name': doctors['doctor_name'],
+            'specialty': doctors['specialty'],
+            'clinic': doctors['clinic'],
+            'location': doctors['location'],
+            'medicine_prescribed': prescribed_medicine,
+            'quantity': np.random.randint(10, 60, n_prescriptions),
+            'patient_age_group': np.random.choice(['0-18', '19-35', '36-50', '51-65', '65+'], n_prescriptions),
+            'chronic_condition': np.random.choice([True, False], n_prescriptions, p=[0.3, 0.7]),
+            'refill_expected': np.random.choice([True, False], n_prescriptions, p=[0.4, 0.6])
+        })
+    
     def call_gemini_multi_key(self, prompt):
-        """Call Gemini API"""
+        """Call Gemini API (cached by prompt hash)"""
+        cache_key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        if cache_key in self._llm_cache:
+            self._llm_cache.move_to_end(cache_key)
+            return self._llm_cache[cache_key]
+        
         for key_idx in range(len(API_KEYS)):
-            api_key = API_KEYS[(self.current_key_index + key_idx) % len(API_KEYS)]
-            client = genai.Client(api_key=api_key)
+            key_pos = (self.current_key_index + key_idx) % len(API_KEYS)
+            client = _gemini_client(API_KEYS[key_pos])
             
             for model_name in AVAILABLE_MODELS:
                 try:
@@ -155,6 +272,10 @@ class PrescriptionIntelligenceAgent:
                         contents=prompt,
                         config=types.GenerateContentConfig(temperature=0.7)
                     )
+                    self.current_key_index = key_pos
+                    self._llm_cache[cache_key] = response.text
+                    if len(self._llm_cache) > LLM_CACHE_SIZE:
+                        self._llm_cache.popitem(last=False)
                     return response.text
                 except:
                     continue
@@ -169,53 +290,80 @@ class PrescriptionIntelligenceAgent:
         print("\n👨‍⚕️ DOCTOR PRESCRIBING BEHAVIOR ANALYSIS")
         print("=" * 80)
         
-        # Filter data
-        data = self.prescription_df.copy()
-        if location:
-            data = data[data['location'] == location]
-        if specialty:
-            data = data[data['specialty'] == specialty]
-        
-        # Top prescribing doctors
-        doctor_stats = data.groupby(['doctor_id', 'doctor_name', 'specialty', 'clinic', 'location']).agg({
-            'prescription_id': 'count',
-            'medicine_prescribed': lambda x: x.mode()[0] if len(x.mode()) > 0 else None
-        }).reset_index()
-        doctor_stats.columns = ['doctor_id', 'doctor_name', 'specialty', 'clinic', 'location', 
-                                'total_prescriptions', 'most_prescribed']
-        doctor_stats = doctor_stats.sort_values('total_prescriptions', ascending=False)
-        
-        # Specialty patterns
-        specialty_stats = data.groupby('specialty')['prescription_id'].count().sort_values(ascending=False)
-        
-        # Medicine patterns
-        medicine_stats = data['medicine_prescribed'].value_counts().head(10)
+        behavior = self._doctor_behavior_stats(location, specialty)
+        doctor_stats = behavior['doctor_stats']
+        specialty_stats = behavior['specialty_stats']
+        medicine_stats = behavior['medicine_stats']
         
         print(f"\n📊 OVERALL STATISTICS:")
-        print(f"  Total Prescriptions: {len(data):,}")
-        print(f"  Doctors: {data['doctor_id'].nunique()}")
-        print(f"  Clinics: {data['clinic'].nunique()}")
+        print(f"  Total Prescriptions: {behavior['total_prescriptions']:,}")
+        print(f"  Doctors: {behavior['doctors']}")
+        print(f"  Clinics: {behavior['clinics']}")
         
         print(f"\n🏆 TOP 5 PRESCRIBING DOCTORS:")
-        for i, row in doctor_stats.head(5).iterrows():
-            print(f"\n{i+1}. {row['doctor_name']} ({row['specialty']})")
-            print(f"   Clinic: {row['clinic']}, {row['location']}")
-            print(f"   Prescriptions: {row['total_prescriptions']}")
-            print(f"   Most Prescribed: {row['most_prescribed']}")
+        for i, row in enumerate(doctor_stats.head(5).itertuples(index=False), 1):
+            print(f"\n{i}. {row.doctor_name} ({row.specialty})")
+            print(f"   Clinic: {row.clinic}, {row.location}")
+            print(f"   Prescriptions: {row.total_prescriptions}")
+            print(f"   Most Prescribed: {row.most_prescribed}")
         
         print(f"\n📋 TOP SPECIALTIES:")
         for specialty, count in specialty_stats.head(5).items():
-            pct = (count / len(data)) * 100
+            pct = (count / behavior['total_prescriptions']) * 100
             print(f"  {specialty}: {count} ({pct:.1f}%)")
         
         return {
             "success": True,
-            "total_prescriptions": len(data),
+            "total_prescriptions": behavior['total_prescriptions'],
             "doctor_stats": doctor_stats.to_dict('records'),
             "specialty_stats": specialty_stats.to_dict(),
             "medicine_stats": medicine_stats.to_dict()
         }
     
+    def _doctor_behavior_stats(self, location=None, specialty=None):
+        """Doctor/specialty/medicine aggregates for a filter, memoized until the data is regenerated"""
+        cache_key = (location, specialty)
+        if cache_key in self._behavior_cache:
+            return self._behavior_cache[cache_key]
+        
+        # Filter data (no copy needed - nothing below mutates it)
+        data = self.prescription_df
+        if location or specialty:
+            mask = np.ones(len(data), dtype=bool)
+            if location:
+                mask &= (data['location'] == location).to_numpy()
+            if specialty:
+                mask &= (data['specialty'] == specialty).to_numpy()
+            data = data[mask]
+        
+        # Most prescribed medicine per doctor (ties go to the first name alphabetically, like mode())
+        medicine_counts = data.groupby(['doctor_id', 'medicine_prescribed'], observed=True).size()
+        most_prescribed = dict(medicine_counts.sort_values(ascending=False, kind='stable')
+                               .groupby(level='doctor_id', observed=True).head(1).index)
+        
+        # Top prescribing doctors
+        doctor_stats = data.groupby(['doctor_id', 'doctor_name', 'specialty', 'clinic', 'location'], observed=True).agg(
+            total_prescriptions=('prescription_id', 'count')
+        ).reset_index()
+        doctor_stats['most_prescribed'] = doctor_stats['doctor_id'].map(most_prescribed)
+        doctor_stats = doctor_stats.sort_values('total_prescriptions', ascending=False)
+        
+        # Specialty patterns
+        specialty_stats = data.groupby('specialty', observed=True)['prescription_id'].count().sort_values(ascending=False)
+        
+        # Medicine patterns
+        medicine_stats = _top_k_counts(data['medicine_prescribed'], 10)
+        
+        self._behavior_cache[cache_key] = {
+            'total_prescriptions': len(data),
+            'doctors': data['doctor_id'].nunique(),
+            'clinics': data['clinic'].nunique(),
+            'doctor_stats': doctor_stats,
+            'specialty_stats': specialty_stats,
+            'medicine_stats': medicine_stats
+        }
+        return self._behavior_cache[cache_key]
+    
     # ========================================================================
     # CAPABILITY 2: Predict Upcoming Demand by Clinic/Location (NEW!)
     # ========================================================================
@@ -225,52 +373,35 @@ class PrescriptionIntelligenceAgent:
         print(f"\n📍 DEMAND PREDICTION BY CLINIC/LOCATION (Next {days_ahead} days)")
         print("=" * 80)
         
+        by_location = self._location_stats
+        by_clinic = self._clinic_stats
+        
         predictions_by_location = []
         
         for location in self.locations.keys():
-            location_data = self.prescription_df[self.prescription_df['location'] == location]
-            
-            # Calculate daily prescription rate
-            days_of_data = (location_data['date'].max() - location_data['date'].min()).days
-            daily_rx_rate = len(location_data) / days_of_data if days_of_data > 0 else 0
+            stats = by_location.loc[location]
             
             # Predict for next N days
-            predicted_prescriptions = daily_rx_rate * days_ahead
-            
-            # Top medicines by this location
-            top_medicines = location_data['medicine_prescribed'].value_counts().head(5)
-            
             predictions_by_location.append({
                 'location': location,
-                'current_daily_rx': round(daily_rx_rate, 1),
-                'predicted_total_rx': round(predicted_prescriptions, 0),
-                'top_medicines': top_medicines.to_dict(),
-                'clinics_count': location_data['clinic'].nunique(),
-                'doctors_count': location_data['doctor_id'].nunique()
+                'current_daily_rx': round(stats['daily_rx_rate'], 1),
+                'predicted_total_rx': round(stats['daily_rx_rate'] * days_ahead, 0),
+                'top_medicines': self._location_medicines[location].head(5).to_dict(),
+                'clinics_count': int(stats['clinics_count']),
+                'doctors_count': int(stats['doctors_count'])
             })
         
         # Sort by predicted volume
         predictions_by_location.sort(key=lambda x: x['predicted_total_rx'], reverse=True)
         
         # Predictions by clinic
-        predictions_by_clinic = []
-        
-        for clinic in self.prescription_df['clinic'].unique():
-            clinic_data = self.prescription_df[self.prescription_df['clinic'] == clinic]
-            
-            days_of_data = (clinic_data['date'].max() - clinic_data['date'].min()).days
-            daily_rx_rate = len(clinic_data) / days_of_data if days_of_data > 0 else 0
-            predicted_prescriptions = daily_rx_rate * days_ahead
-            
-            top_medicine = clinic_data['medicine_prescribed'].value_counts().iloc[0] if len(clinic_data) > 0 else None
-            
-            predictions_by_clinic.append({
-                'clinic': clinic,
-                'location': clinic_data['location'].iloc[0],
-                'predicted_prescriptions': round(predicted_prescriptions, 0),
-                'top_medicine': top_medicine,
-                'doctors': clinic_data['doctor_id'].nunique()
-            })
+        predictions_by_clinic = pd.DataFrame({
+            'clinic': by_clinic.index,
+            'location': by_clinic['location'].to_numpy(),
+            'predicted_prescriptions': (by_clinic['daily_rx_rate'] * days_ahead).round(0).to_numpy(),
+            'top_medicine': by_clinic['top_medicine'].to_numpy(),
+            'doctors': by_clinic['doctors'].to_numpy()
+        }).to_dict('records')
         
         predictions_by_clinic.sort(key=lambda x: x['predicted_prescriptions'], reverse=True)
         
@@ -306,30 +437,19 @@ class PrescriptionIntelligenceAgent:
         recommendations = []
         
         for location in self.locations.keys():
-            location_rx = self.prescription_df[self.prescription_df['location'] == location]
+            stats = self._location_stats.loc[location]
             
             # Top 5 medicines for this location
-            top_medicines = location_rx['medicine_prescribed'].value_counts().head(5)
-            
-            # Specialty distribution
-            specialties = location_rx['specialty'].value_counts()
-            top_specialty = specialties.iloc[0] if len(specialties) > 0 else None
-            
-            # Patient demographics
-            age_groups = location_rx['patient_age_group'].value_counts()
-            dominant_age_group = age_groups.iloc[0] if len(age_groups) > 0 else None
-            
-            # Chronic condition rate
-            chronic_rate = location_rx['chronic_condition'].mean() * 100
+            top_medicines = self._location_medicines[location].head(5)
             
             recommendations.append({
                 'location': location,
                 'priority_medicines': list(top_medicines.index),
-                'stock_quantities': [int(count * 1.5) for count in top_medicines.values],  # 1.5x safety factor
-                'dominant_specialty': specialties.index[0],
-                'dominant_age_group': dominant_age_group,
-                'chronic_condition_rate': round(chronic_rate, 1),
-                'recommended_actions': self._get_location_actions(location, top_specialty, chronic_rate)
+                'stock_quantities': np.ceil(top_medicines.to_numpy(dtype=np.float64) * 1.5).astype(np.int64).tolist(),  # 1.5x safety factor, rounded up
+                'dominant_specialty': stats['top_specialty'],
+                'dominant_age_group': stats['dominant_age_group'],
+                'chronic_condition_rate': round(stats['chronic_rate'], 1),
+                'recommended_actions': self._get_location_actions(location, stats['top_specialty'], stats['chronic_rate'])
             })
         
         print(f"\n🎯 LOCATION-SPECIFIC RECOMMENDATIONS:")
@@ -349,21 +469,8 @@ class PrescriptionIntelligenceAgent:
     
     def _get_location_actions(self, location, top_specialty, chronic_rate):
         """Generate specific actions for location"""
-        actions = []
-        
-        if chronic_rate > 40:
-            actions.append("Stock 30-day supplies for chronic medications")
-        
-        if top_specialty == 'Cardiologist':
-            actions.append("Promote heart health supplements")
-        elif top_specialty == 'Diabetologist':
-            actions.append("Stock diabetic care products")
-        elif top_specialty == 'Pediatrician':
-            actions.append("Focus on children's medicines and vitamins")
-        
-        actions.append("Partner with local clinics for prescription fulfillment")
-        
-        return " | ".join(actions)
+        actions = [CHRONIC_ACTION if chronic_rate > 40 else None, SPECIALTY_ACTIONS.get(top_specialty), CLINIC_PARTNER_ACTION]
+        return " | ".join(filter(None, actions))
     
     # ========================================================================
     # AI-POWERED INSIGHTS
@@ -374,22 +481,12 @@ class PrescriptionIntelligenceAgent:
         print("\n🤖 AI-POWERED PRESCRIPTION INSIGHTS")
         print("=" * 80)
         
-        analysis = self.analyze_doctor_prescribing_behavior(location)
-        demand = self.predict_demand_by_clinic_location(30)
-        stocking = self.generate_targeted_stocking_recommendations()
+        summary = self._summary_stats(location)
         
         location_filter = f" for {location}" if location else ""
         
-        prompt = f"""You are a pharmacy prescription intelligence expert. Analyze these prescription patterns{location_filter}.
-
-PRESCRIPTION STATISTICS:
-- Total Prescriptions: {analysis['total_prescriptions']:,}
-- Unique Doctors: {len(analysis['doctor_stats'])}
-- Top Medicines: {', '.join(list(analysis['medicine_stats'].keys())[:5])}
-
-LOCATION INSIGHTS:
-- Locations: {len(demand['by_location'])}
-- Top Location Demand: {demand['by_location'][0]['predicted_total_rx']:.0f} prescriptions/month
+        # Fixed instructions first, so repeated calls share a cacheable prompt prefix
+        prompt = f"""You are a pharmacy prescription intelligence expert. Analyze the prescription patterns below.
 
 Provide:
 1. Prescription pattern insights
@@ -398,7 +495,16 @@ Provide:
 4. Stock optimization recommendations
 5. Revenue growth opportunities
 
-Keep response concise."""
+Keep response concise.
+
+PRESCRIPTION STATISTICS{location_filter}:
+- Total Prescriptions: {summary['total_prescriptions']:,}
+- Unique Doctors: {summary['doctors']}
+- Top Medicines: {', '.join(summary['top_medicines'])}
+
+LOCATION INSIGHTS:
+- Locations: {summary['locations']}
+- Top Location Demand: {summary['top_location_rx']:.0f} prescriptions/month"""
         
         insights = self.call_gemini_multi_key(prompt)
         
@@ -409,6 +515,17 @@ Keep response concise."""
             "success": True,
             "insights": insights
         }
+    
+    def _summary_stats(self, location=None):
+        """Just the figures the insights prompt uses, from the cached aggregates (nothing printed)"""
+        behavior = self._doctor_behavior_stats(location)
+        return {
+            'total_prescriptions': behavior['total_prescriptions'],
+            'doctors': behavior['doctors'],
+            'top_medicines': list(behavior['medicine_stats'].index[:5]),
+            'locations': len(self.locations),
+            'top_location_rx': round((self._location_stats['daily_rx_rate'] * 30).max(), 0)
+        }
 
 
 def main():
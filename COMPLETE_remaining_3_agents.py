@@ -12,7 +12,7 @@ COST: $0 (Uses FREE Gemini API)
 
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 from dotenv import load_dotenv
 from google import genai
@@ -20,15 +20,21 @@ from google.genai import types
 
 load_dotenv()
 
-API_KEYS = []
-for i in range(1, 10):
-    key = os.getenv(f"GEMINI_API_KEY_{i if i > 1 else ''}")
-    if key:
-        API_KEYS.append(key)
+# GEMINI_API_KEY, GEMINI_API_KEY_2 ... GEMINI_API_KEY_9, read in one pass
+API_KEY_NAMES = ('GEMINI_API_KEY',) + tuple(f'GEMINI_API_KEY_{i}' for i in range(2, 10))
+API_KEYS = tuple(key for key in map(os.environ.get, API_KEY_NAMES) if key)
 
 AVAILABLE_MODELS = ['gemini-2.0-flash', 'gemini-1.5-flash']
 
 
+def _campaign_scores(revenue, cost, participation, duration):
+    """ROI, revenue per day and effectiveness score for float64 campaign arrays"""
+    roi = (revenue - cost) / cost
+    revenue_per_day = revenue / duration
+    effectiveness_score = roi * 0.4 + participation * 100 * 0.3 + (revenue_per_day / 1000) * 0.3
+    return roi, revenue_per_day, effectiveness_score
+
+
 # ============================================================================
 # AGENT 8: PROMOTION EFFECTIVENESS AGENT (Section 3.2)
 # ============================================================================
@@ -67,18 +73,16 @@ class PromotionEffectivenessAgent:
             'participation_rate': np.random.uniform(0.15, 0.55, 10)
         })
         
-        # Calculate ROI
-        self.campaigns['roi'] = (self.campaigns['revenue_generated'] - 
-                                 self.campaigns['cost']) / self.campaigns['cost']
-        
-        self.campaigns['revenue_per_day'] = (self.campaigns['revenue_generated'] / 
-                                              self.campaigns['duration_days'])
-        
-        self.campaigns['effectiveness_score'] = (
-            self.campaigns['roi'] * 0.4 +
-            self.campaigns['participation_rate'] * 100 * 0.3 +
-            (self.campaigns['revenue_per_day'] / 1000) * 0.3
+        # Calculate ROI, revenue per day and effectiveness score
+        roi, revenue_per_day, effectiveness_score = _campaign_scores(
+            self.campaigns['revenue_generated'].to_numpy(dtype=np.float64),
+            self.campaigns['cost'].to_numpy(dtype=np.float64),
+            self.campaigns['participation_rate'].to_numpy(dtype=np.float64),
+            self.campaigns['duration_days'].to_numpy(dtype=np.float64)
         )
+        self.campaigns['roi'] = roi
+        self.campaigns['revenue_per_day'] = revenue_per_day
+        self.campaigns['effectiveness_score'] = effectiveness_score
     
     def measure_campaign_roi(self):
         """Measure ROI of each campaign"""
@@ -88,10 +92,10 @@ class PromotionEffectivenessAgent:
         sorted_campaigns = self.campaigns.sort_values('roi', ascending=False)
         
         print(f"\n🏆 TOP 5 BY ROI:")
-        for i, row in sorted_campaigns.head(5).iterrows():
-            print(f"\n{i+1}. {row['campaign_name']} ({row['campaign_type']})")
-            print(f"   ROI: {row['roi']:.2f}x | Revenue: ${row['revenue_generated']:,.2f}")
-            print(f"   Participation: {row['participation_rate']*100:.1f}%")
+        for i, row in enumerate(sorted_campaigns.head(5).itertuples(index=False), 1):
+            print(f"\n{i}. {row.campaign_name} ({row.campaign_type})")
+            print(f"   ROI: {row.roi:.2f}x | Revenue: ${row.revenue_generated:,.2f}")
+            print(f"   Participation: {row.participation_rate*100:.1f}%")
         
         return {"success": True, "campaigns": sorted_campaigns.to_dict('records')}
     
@@ -108,8 +112,8 @@ class PromotionEffectivenessAgent:
         }).sort_values('effectiveness_score', ascending=False)
         
         print(f"\n🎯 BEST PERFORMING TYPES:")
-        for campaign_type, stats in by_type.iterrows():
-            print(f"  {campaign_type}: ROI {stats['roi']:.2f}x | Score: {stats['effectiveness_score']:.1f}")
+        for stats in by_type.itertuples():
+            print(f"  {stats.Index}: ROI {stats.roi:.2f}x | Score: {stats.effectiveness_score:.1f}")
         
         return {"success": True, "by_type": by_type.to_dict()}
 
@@ -132,11 +136,13 @@ class ComplianceRegulationAgent:
     def load_data(self):
         """Load inventory data"""
         try:
-            self.inventory = pd.read_csv("data/current_inventory.csv")
-            self.inventory['expiry_date'] = pd.to_datetime(self.inventory['expiry_date'])
-        except:
+            self.inventory = pd.read_csv("data/current_inventory.csv", engine='pyarrow', parse_dates=['expiry_date'])
+        except FileNotFoundError:
             print("Using sample data")
             self.inventory = pd.DataFrame()
+            return
+        # datetime64 array in whatever unit the parser chose ([s] or [ns]); numpy aligns units on subtraction
+        self._expiry_dates = self.inventory['expiry_date'].dropna().to_numpy()
     
     def ensure_storage_compliance(self):
         """Check storage and expiry compliance"""
@@ -147,27 +153,26 @@ class ComplianceRegulationAgent:
             print("No inventory data")
             return {"success": False}
         
-        # Check expiry compliance
-        today = datetime.now()
-        expired = self.inventory[self.inventory['expiry_date'] < today]
-        expiring_30 = self.inventory[
-            (self.inventory['expiry_date'] >= today) &
-            (self.inventory['expiry_date'] <= today + timedelta(days=30))
-        ]
+        # Check expiry compliance: count both bands from one pass over time-to-expiry
+        until_expiry = self._expiry_dates - np.datetime64(datetime.now())
+        expired_count = int(np.count_nonzero(until_expiry < np.timedelta64(0)))
+        expiring_count = int(np.count_nonzero(
+            (until_expiry >= np.timedelta64(0)) & (until_expiry <= np.timedelta64(30, 'D'))
+        ))
         
         print(f"\n📊 COMPLIANCE STATUS:")
-        print(f"  Expired Items: {len(expired)} {'❌ NON-COMPLIANT' if len(expired) > 0 else '✅ COMPLIANT'}")
-        print(f"  Expiring <30 days: {len(expiring_30)}")
+        print(f"  Expired Items: {expired_count} {'❌ NON-COMPLIANT' if expired_count > 0 else '✅ COMPLIANT'}")
+        print(f"  Expiring <30 days: {expiring_count}")
         
-        compliance_score = 100 - (len(expired) * 10) - (len(expiring_30) * 2)
+        compliance_score = 100 - (expired_count * 10) - (expiring_count * 2)
         compliance_score = max(0, min(100, compliance_score))
         
         print(f"\n🎯 Overall Compliance Score: {compliance_score}/100")
         
         return {
             "success": True,
-            "expired_count": len(expired),
-            "expiring_soon": len(expiring_30),
+            "expired_count": expired_count,
+            "expiring_soon": expiring_count,
             "compliance_score": compliance_score
         }
     
@@ -287,8 +292,8 @@ class CustomerPersonalizationAgent:
         
         print(f"\n📊 {len(refill_candidates)} Customers Need Refill Reminders")
         
-        for i, customer in refill_candidates.head(5).iterrows():
-            print(f"  {customer['customer_id']}: Last purchase {customer['last_purchase_days_ago']} days ago")
+        for customer in refill_candidates.head(5).itertuples(index=False):
+            print(f"  {customer.customer_id}: Last purchase {customer.last_purchase_days_ago} days ago")
         
         return {
             "success": True,
@@ -22,9 +22,15 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import os
+import hashlib
+import json
+import random
+import time
+from collections import OrderedDict
+import httpx
 from dotenv import load_dotenv
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 
 load_dotenv()
 
@@ -47,6 +53,58 @@ AVAILABLE_MODELS = [
     'gemini-1.5-flash',
     'gemini-2.5-flash',
 ]
+KEY_COOLDOWN_SECONDS = 30  # Rest a rate-limited key this long (plus jitter)
+LLM_CACHE_SIZE = 256  # Most recent prompt responses kept
+LLM_CACHE_PATH = "data/transfer_llm_cache.json"  # Persistent copy of the response cache
+LLM_CACHE_MAX_AGE_SECONDS = 24 * 60 * 60  # Older responses are fetched again
+NS_PER_DAY = 86_400_000_000_000
+
+INVENTORY_CSV = "data/current_inventory.csv"
+INVENTORY_PARQUET = "data/current_inventory.parquet"  # Columnar cache of INVENTORY_CSV
+SALES_CSV = "data/sales_history.csv"
+SALES_PARQUET = "data/sales_history.parquet"  # Columnar cache of SALES_CSV
+SALES_COLUMNS = ['date', 'sku', 'store_id', 'quantity_sold']  # all this agent reads
+
+_DATA_CACHE = {}  # (CSV path, CSV mtime, columns) -> parsed frame, shared by agents in this process
+
+
+def _read_memoized_csv(csv_path, parquet_path, date_column, columns=None):
+    """Parsed CSV, memoized per process and backed by a parquet copy; both refresh when the CSV changes"""
+    csv_mtime = os.path.getmtime(csv_path)
+    key = (os.path.abspath(csv_path), csv_mtime, None if columns is None else tuple(columns))
+    if key not in _DATA_CACHE:
+        if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= csv_mtime:
+            data = pd.read_parquet(parquet_path, columns=columns)
+        else:
+            data = pd.read_csv(csv_path, parse_dates=[date_column])
+            try:
+                data.to_parquet(parquet_path, index=False)  # full copy - other agents read more columns
+            except OSError:
+                pass  # Read-only data directory - keep using the CSV
+            if columns is not None:
+                data = data[columns]
+        for stale_key in [k for k in _DATA_CACHE if k[0] == key[0] and k[1] != csv_mtime]:
+            del _DATA_CACHE[stale_key]
+        _DATA_CACHE[key] = data
+    # Shallow copy: agents can add columns without touching the shared frame
+    return _DATA_CACHE[key].copy(deep=False)
+
+
+def _load_llm_cache():
+    """Unexpired responses saved by earlier runs, oldest first"""
+    try:
+        with open(LLM_CACHE_PATH) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return OrderedDict()
+    if not isinstance(saved, dict):
+        return OrderedDict()  # Not a cache file we wrote - start empty
+    cutoff = time.time() - LLM_CACHE_MAX_AGE_SECONDS
+    fresh = [
+        (key, entry) for key, entry in saved.items()
+        if isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], (int, float)) and entry[0] >= cutoff
+    ]
+    return OrderedDict(fresh[-LLM_CACHE_SIZE:])
 
 
 class StoreTransferOptimizationAgent:
@@ -63,6 +121,9 @@ class StoreTransferOptimizationAgent:
         print("=" * 80)
         
         self.current_key_index = 0
+        self._clients = [genai.Client(api_key=key) for key in API_KEYS]  # one client per key, reused
+        self._key_cooldown = {}  # key position -> time.time() when it may be retried
+        self._llm_cache = _load_llm_cache()  # SHA-256 of prompt -> (saved at, response text)
         self.inventory_data = None
         self.sales_data = None
         self.load_data()
@@ -73,24 +134,47 @@ class StoreTransferOptimizationAgent:
         """Load inventory and sales data"""
         try:
             print("Loading data...")
-            self.inventory_data = pd.read_csv("data/current_inventory.csv")
-            self.inventory_data['expiry_date'] = pd.to_datetime(self.inventory_data['expiry_date'])
+            self.inventory_data = _read_memoized_csv(INVENTORY_CSV, INVENTORY_PARQUET, 'expiry_date')
             print(f"  ✓ Loaded {len(self.inventory_data):,} inventory records")
             
-            self.sales_data = pd.read_csv("data/sales_history.csv")
-            self.sales_data['date'] = pd.to_datetime(self.sales_data['date'])
+            self.sales_data = _read_memoized_csv(SALES_CSV, SALES_PARQUET, 'date', columns=SALES_COLUMNS)
             print(f"  ✓ Loaded {len(self.sales_data):,} sales records")
             
+            self.inventory_data['current_stock'] = self.inventory_data['current_stock'].astype('int32')
+            # Expiry as integer nanoseconds; days_to_expiry is derived once per calendar day
+            self._expiry_ns = self.inventory_data['expiry_date'].to_numpy().astype('datetime64[ns]').view('int64')
+            self._expiry_as_of = None
+            self._refresh_days_to_expiry()
+            
         except FileNotFoundError:
             print("\n❌ ERROR: Data files not found!")
             print("Run: python generate_sample_data.py")
             raise
     
+    def _refresh_days_to_expiry(self):
+        """Recompute inventory_data['days_to_expiry'] (int32) if the date changed since it was last set"""
+        now = datetime.now()
+        if self._expiry_as_of == now.date():
+            return
+        self._expiry_as_of = now.date()
+        now_ns = pd.Timestamp(now).value
+        self._days_to_expiry = ((self._expiry_ns - now_ns) // NS_PER_DAY).astype('int32')  # row-aligned array
+        self.inventory_data['days_to_expiry'] = self._days_to_expiry
+    
     def call_gemini_multi_key(self, prompt):
-        """Try multiple API keys until one works"""
+        """Try multiple API keys until one works, skipping keys that are cooling down (cached by prompt hash)"""
+        cache_key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        cached = self._llm_cache.get(cache_key)
+        if cached and time.time() - cached[0] < LLM_CACHE_MAX_AGE_SECONDS:
+            self._llm_cache.move_to_end(cache_key)
+            return cached[1]
+        
+        start_index = self.current_key_index
         for key_idx in range(len(API_KEYS)):
-            api_key = API_KEYS[(self.current_key_index + key_idx) % len(API_KEYS)]
-            client = genai.Client(api_key=api_key)
+            key_pos = (start_index + key_idx) % len(API_KEYS)
+            if time.time() < self._key_cooldown.get(key_pos, 0):
+                continue
+            client = self._clients[key_pos]
             
             for model_name in AVAILABLE_MODELS:
                 try:
@@ -99,89 +183,101 @@ class StoreTransferOptimizationAgent:
                         contents=prompt,
                         config=types.GenerateContentConfig(temperature=0.7)
                     )
-                    self.current_key_index = (self.current_key_index + key_idx) % len(API_KEYS)
+                    self.current_key_index = key_pos  # start from the working key next time
+                    self._remember_response(cache_key, response.text)
                     return response.text
-                except Exception as e:
-                    error_str = str(e)
-                    if any(x in error_str for x in ['429', 'RESOURCE_EXHAUSTED', '404', 'NOT_FOUND']):
-                        continue
-                    else:
-                        continue
+                except errors.APIError as e:
+                    if e.code == 429:
+                        # Quota hit: rest this key and move on to the next one
+                        self._key_cooldown[key_pos] = time.time() + KEY_COOLDOWN_SECONDS + random.uniform(0, 5)
+                        break
+                    if e.code == 404 or e.code >= 500:
+                        continue  # Model unavailable or transient server error
+                    return f"⚠️ API request failed ({e.code})"
+                except httpx.HTTPError:
+                    continue  # Network error - try the next model/key
         
         return f"⚠️ All {len(API_KEYS)} API keys at capacity."
     
+    def _remember_response(self, cache_key, text):
+        """Add a response to the LRU cache and persist it for later runs"""
+        self._llm_cache[cache_key] = (time.time(), text)
+        self._llm_cache.move_to_end(cache_key)
+        if len(self._llm_cache) > LLM_CACHE_SIZE:
+            self._llm_cache.popitem(last=False)
+        # Write a temp file and swap it in, so a crash never leaves a truncated cache
+        tmp_path = f"{LLM_CACHE_PATH}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._llm_cache, f)
+            os.replace(tmp_path, LLM_CACHE_PATH)
+        except OSError:
+            pass  # Read-only data directory - keep the in-memory cache only
+    
+    def _recent_store_sales(self, now):
+        """Units sold and selling days per SKU/store over the 30 days before now, in one pass"""
+        recent_sales = self.sales_data[self.sales_data['date'] >= now - timedelta(days=30)]
+        return recent_sales.groupby(['sku', 'store_id'], observed=True).agg(
+            units=('quantity_sold', 'sum'),
+            days=('date', 'nunique')
+        )
+    
     def analyze_store_inventory_imbalance(self):
         """Identify products with inventory imbalance across stores"""
         print("\n⚖️ STORE INVENTORY IMBALANCE ANALYSIS")
         print("=" * 80)
         
-        imbalances = []
-        
-        # Group by SKU
-        for sku in self.inventory_data['sku'].unique():
-            sku_inventory = self.inventory_data[self.inventory_data['sku'] == sku]
-            
-            if len(sku_inventory) < 2:
-                continue  # Need at least 2 stores
-            
-            product_name = sku_inventory['product_name'].iloc[0]
-            
-            # Calculate sales velocity per store
-            sku_sales = self.sales_data[self.sales_data['sku'] == sku]
-            recent_sales = sku_sales[sku_sales['date'] >= datetime.now() - timedelta(days=30)]
-            
-            store_velocities = {}
-            for store_id in sku_inventory['store_id'].unique():
-                store_sales = recent_sales[recent_sales['store_id'] == store_id]
-                daily_velocity = store_sales.groupby('date')['quantity_sold'].sum().mean() if len(store_sales) > 0 else 0
-                store_velocities[store_id] = daily_velocity
-            
-            # Find overstocked and understocked stores
-            for _, row in sku_inventory.iterrows():
-                store_id = row['store_id']
-                current_stock = row['current_stock']
-                velocity = store_velocities.get(store_id, 0)
-                days_to_expiry = (row['expiry_date'] - datetime.now()).days
-                
-                # Calculate days of supply
-                days_of_supply = current_stock / velocity if velocity > 0 else 999
-                
-                # Identify imbalance
-                if days_of_supply > days_to_expiry and days_to_expiry < 90:
-                    # Overstocked - will expire before selling
-                    imbalances.append({
-                        'sku': sku,
-                        'product_name': product_name,
-                        'from_store': store_id,
-                        'current_stock': int(current_stock),
-                        'daily_velocity': round(velocity, 2),
-                        'days_of_supply': round(days_of_supply, 1),
-                        'days_to_expiry': int(days_to_expiry),
-                        'issue': 'OVERSTOCKED',
-                        'urgency': 'HIGH' if days_to_expiry < 30 else 'MEDIUM'
-                    })
-                elif days_of_supply < 7 and velocity > 0:
-                    # Understocked - will stock out soon
-                    imbalances.append({
-                        'sku': sku,
-                        'product_name': product_name,
-                        'from_store': store_id,
-                        'current_stock': int(current_stock),
-                        'daily_velocity': round(velocity, 2),
-                        'days_of_supply': round(days_of_supply, 1),
-                        'days_to_expiry': int(days_to_expiry),
-                        'issue': 'UNDERSTOCKED',
-                        'urgency': 'HIGH' if days_of_supply < 3 else 'MEDIUM'
-                    })
-        
-        # Sort by urgency
-        imbalances.sort(key=lambda x: (x['urgency'] == 'HIGH', x['days_to_expiry']), reverse=True)
+        self._refresh_days_to_expiry()
+        now = datetime.now()
+        inventory = self.inventory_data
+        
+        # Average daily sales per SKU/store over the last 30 days (days with sales only)
+        store_sales = self._recent_store_sales(now)
+        velocities = (store_sales['units'] / store_sales['days']).rename('daily_velocity')
+        
+        # Keep SKUs in first-seen order; need at least 2 stores per SKU
+        data = inventory.iloc[np.argsort(pd.factorize(inventory['sku'])[0], kind='stable')]
+        data = data[data.groupby('sku', observed=True)['sku'].transform('size') >= 2]
+        data = data.merge(velocities, left_on=['sku', 'store_id'], right_index=True, how='left')
+        
+        velocity = data['daily_velocity'].fillna(0).to_numpy()
+        current_stock = data['current_stock'].to_numpy()
+        days_to_expiry = data['days_to_expiry'].to_numpy()
+        
+        # Calculate days of supply
+        has_sales = velocity > 0
+        days_of_supply = np.divide(current_stock, velocity, out=np.full(len(data), 999.0), where=has_sales)
+        
+        # Overstocked will expire before selling; understocked will stock out soon
+        overstocked_mask = (days_of_supply > days_to_expiry) & (days_to_expiry < 90)
+        understocked_mask = ~overstocked_mask & (days_of_supply < 7) & has_sales
+        high_urgency = np.where(overstocked_mask, days_to_expiry < 30, days_of_supply < 3)
+        
+        imbalance_df = pd.DataFrame({
+            'sku': data['sku'].to_numpy(),
+            'product_name': data.groupby('sku', observed=True)['product_name'].transform('first').to_numpy(),
+            'from_store': data['store_id'].to_numpy(),
+            'current_stock': current_stock,
+            'daily_velocity': velocity.round(2),
+            'days_of_supply': days_of_supply.round(1),
+            'days_to_expiry': days_to_expiry,
+            'issue': np.select([overstocked_mask, understocked_mask], ['OVERSTOCKED', 'UNDERSTOCKED'], default=''),
+            'urgency': np.where(high_urgency, 'HIGH', 'MEDIUM'),
+        })[overstocked_mask | understocked_mask]
+        
+        # Sort by urgency (HIGH first, then latest expiry; ties keep SKU order)
+        order = np.lexsort((
+            -imbalance_df['days_to_expiry'].to_numpy(),
+            imbalance_df['urgency'].to_numpy() != 'HIGH',
+        ))
+        imbalance_df = imbalance_df.iloc[order]
+        
+        imbalances = imbalance_df.to_dict('records')
+        overstocked = imbalance_df[imbalance_df['issue'] == 'OVERSTOCKED'].to_dict('records')
+        understocked = imbalance_df[imbalance_df['issue'] == 'UNDERSTOCKED'].to_dict('records')
         
         print(f"\n📊 IMBALANCES DETECTED: {len(imbalances)}")
         
-        overstocked = [i for i in imbalances if i['issue'] == 'OVERSTOCKED']
-        understocked = [i for i in imbalances if i['issue'] == 'UNDERSTOCKED']
-        
         print(f"  🔴 Overstocked: {len(overstocked)} (risk of expiry)")
         print(f"  🟡 Understocked: {len(understocked)} (risk of stockout)")
         
@@ -208,6 +304,11 @@ class StoreTransferOptimizationAgent:
         
         transfer_recommendations = []
         
+        # Understocked items per SKU, so matching is a lookup instead of a scan
+        understocked_by_sku = {}
+        for understock_item in understocked:
+            understocked_by_sku.setdefault(understock_item['sku'], []).append(understock_item)
+        
         # Match overstocked with understocked for same SKU
         for overstock_item in overstocked:
             sku = overstock_item['sku']
@@ -216,7 +317,7 @@ class StoreTransferOptimizationAgent:
             days_to_expiry = overstock_item['days_to_expiry']
             
             # Find understocked stores for same SKU
-            matching_understock = [u for u in understocked if u['sku'] == sku and u['from_store'] != from_store]
+            matching_understock = [u for u in understocked_by_sku.get(sku, []) if u['from_store'] != from_store]
             
             for understock_item in matching_understock:
                 to_store = understock_item['from_store']
@@ -291,55 +392,46 @@ class StoreTransferOptimizationAgent:
         print(f"\n⚠️ EXPIRY PREVENTION THROUGH TRANSFERS (Next {days_threshold} days)")
         print("=" * 80)
         
-        # Find items expiring soon
-        expiring_items = self.inventory_data[
-            (self.inventory_data['expiry_date'] - datetime.now()).dt.days <= days_threshold
-        ].copy()
-        
-        expiring_items['days_to_expiry'] = (expiring_items['expiry_date'] - datetime.now()).dt.days
-        
-        transfer_opportunities = []
-        
-        for _, item in expiring_items.iterrows():
-            sku = item['sku']
-            from_store = item['store_id']
-            stock = item['current_stock']
-            days_to_expiry = item['days_to_expiry']
-            
-            # Find stores with higher demand for same SKU
-            sku_sales = self.sales_data[self.sales_data['sku'] == sku]
-            recent_sales = sku_sales[sku_sales['date'] >= datetime.now() - timedelta(days=30)]
-            
-            store_demand = recent_sales.groupby('store_id')['quantity_sold'].sum().to_dict()
-            
-            # Find best target store
-            best_target = None
-            best_demand = 0
-            
-            for target_store, demand in store_demand.items():
-                if target_store != from_store and demand > best_demand:
-                    best_demand = demand
-                    best_target = target_store
-            
-            if best_target and best_demand > stock:
-                # Calculate transfer quantity
-                transfer_qty = min(stock, best_demand * 0.5)
-                
-                if transfer_qty >= 5:
-                    transfer_opportunities.append({
-                        'sku': sku,
-                        'product_name': item['product_name'],
-                        'from_store': from_store,
-                        'to_store': best_target,
-                        'transfer_quantity': int(transfer_qty),
-                        'days_to_expiry': int(days_to_expiry),
-                        'target_demand': int(best_demand),
-                        'urgency': 'CRITICAL' if days_to_expiry <= 7 else 'HIGH',
-                        'value_saved': round(transfer_qty * item['unit_price'], 2)
-                    })
+        self._refresh_days_to_expiry()
+        now = datetime.now()
+        
+        # Find items expiring soon (one vector compare on the int32 array)
+        expiring = self._days_to_expiry <= days_threshold
+        expiring_items = self.inventory_data.iloc[expiring]
+        days_to_expiry = self._days_to_expiry[expiring]
+        
+        # SKU x store demand over the last 30 days, aggregated once for all items
+        demand = self._recent_store_sales(now)['units'].unstack(fill_value=0)
+        stores = demand.columns.to_numpy()
+        
+        # Column 0 is "no target" with zero demand, so argmax picks the first other
+        # store with the highest positive demand
+        store_demand = np.zeros((len(expiring_items), len(stores) + 1), dtype=np.int64)
+        store_demand[:, 1:] = demand.reindex(expiring_items['sku'], fill_value=0).to_numpy()
+        store_demand[:, 1:][expiring_items['store_id'].to_numpy()[:, None] == stores] = 0
+        best_pos = store_demand.argmax(axis=1)
+        best_demand = store_demand[np.arange(len(best_pos)), best_pos]
+        
+        # Calculate transfer quantity
+        stock = expiring_items['current_stock'].to_numpy()
+        transfer_qty = np.minimum(stock, best_demand * 0.5)
+        keep = (best_pos > 0) & (best_demand > stock) & (transfer_qty >= 5)
+        
+        opportunities_df = pd.DataFrame({
+            'sku': expiring_items['sku'].to_numpy()[keep],
+            'product_name': expiring_items['product_name'].to_numpy()[keep],
+            'from_store': expiring_items['store_id'].to_numpy()[keep],
+            'to_store': stores[best_pos[keep] - 1],
+            'transfer_quantity': transfer_qty[keep].astype(int),
+            'days_to_expiry': days_to_expiry[keep],
+            'target_demand': best_demand[keep],
+            'urgency': np.where(days_to_expiry[keep] <= 7, 'CRITICAL', 'HIGH'),
+            # Python round (exact decimal halves) rather than np.round, which can be a cent off
+            'value_saved': [round(v, 2) for v in (transfer_qty * expiring_items['unit_price'].to_numpy())[keep].tolist()],
+        })
         
         # Sort by urgency
-        transfer_opportunities.sort(key=lambda x: x['days_to_expiry'])
+        transfer_opportunities = opportunities_df.sort_values('days_to_expiry', kind='stable').to_dict('records')
         
         total_value_saved = sum(t['value_saved'] for t in transfer_opportunities)
         